@@ -0,0 +1,573 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Нагрузочный стенд для обоих ботов без обращения к настоящим сервисам:
+#   - поддельный Telegram Bot API (getUpdates, sendPhoto, sendVideo, sendMediaGroup, ...)
+#     с настраиваемой задержкой и долей ответов 429;
+#   - поддельный сайт Ozon со встроенным JSON-состоянием выдачи;
+#   - поддельный yt-dlp, который вместо скачивания создает файл нужного размера.
+# Результаты печатаются в JSON, чтобы их можно было сравнивать между версиями:
+#   python loadtest.py ozon --users 1000 --urls-per-user 5 --output ozon.json
+#   python loadtest.py youtube --requests 20 --output youtube.json
+
+FAKE_TOKEN = "123:LOADTEST"
+
+# Процентиль по списку значений
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+# p50/p99/максимум в миллисекундах
+def latency_summary(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.5) * 1000, 2) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2) if values else None,
+        "max_ms": round(max(values) * 1000, 2) if values else None,
+    }
+
+# Пиковое потребление памяти процессом и дочерними процессами, КБ (Linux)
+def peak_rss_kb():
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+# Задержка цикла событий: насколько позже запланированного просыпается короткий sleep
+async def monitor_loop_lag(samples, interval=0.05):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+# Обертка корутины, которая записывает время каждого вызова
+def record_latency(func, samples):
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - started)
+    return wrapper
+
+def _git_version():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except Exception:
+        return None
+
+# Поддельный Telegram Bot API
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        method = self.path.rstrip("/").rsplit("/", 1)[-1]
+        server = self.server
+
+        if method == "getUpdates":
+            time.sleep(server.latency)
+            self._reply(200, {"ok": True, "result": []})
+            return
+
+        time.sleep(server.latency)
+        if random.random() < server.rate_limit_ratio:
+            server.record(method, len(body), limited=True)
+            self._reply(429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {server.retry_after}",
+                "parameters": {"retry_after": server.retry_after},
+            })
+            return
+        server.record(method, len(body))
+        self._reply(200, {"ok": True, "result": server.fake_result(method, body, self.headers.get("Content-Type", ""))})
+
+    do_GET = do_POST
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, rate_limit_ratio=0.0, retry_after=1):
+        super().__init__(("127.0.0.1", 0), FakeTelegramHandler)
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.requests = {}  # Метод -> количество успешных вызовов
+        self.rate_limited = 0
+        self.bytes_received = 0
+        self.local_file_bytes = 0  # Видео, переданные по пути к файлу (как для своего сервера Bot API)
+        self._message_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def record(self, method, size, limited=False):
+        with self._lock:
+            self.bytes_received += size
+            if limited:
+                self.rate_limited += 1
+            else:
+                self.requests[method] = self.requests.get(method, 0) + 1
+
+    def _message(self, **extra):
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+        return dict({"message_id": message_id, "date": int(time.time()), "chat": {"id": 0}}, **extra)
+
+    def fake_result(self, method, body, content_type):
+        if method == "getMe":
+            return {"id": 123, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot"}
+        if method == "sendPhoto":
+            return self._message(photo=[{"file_id": f"photo-{self._message_id}", "width": 800, "height": 800}])
+        if method == "sendMediaGroup":
+            media = json.loads(body).get("media", []) if "json" in content_type else [None]
+            return [self._message(photo=[{"file_id": f"photo-{self._message_id}"}]) for _ in media]
+        if method == "sendVideo":
+            size = len(body)
+            if "x-www-form-urlencoded" in content_type:
+                video = urllib.parse.parse_qs(body.decode()).get("video", [""])[0]
+                if video.startswith("file://"):
+                    size = os.path.getsize(video[len("file://"):])
+                    with self._lock:
+                        self.local_file_bytes += size
+            return self._message(video={"file_id": f"video-{self._message_id}", "file_size": size})
+        return self._message()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "rate_limited": self.rate_limited,
+                "bytes_received": self.bytes_received,
+                "local_file_bytes": self.local_file_bytes,
+            }
+
+# Поддельный сайт Ozon
+
+class FakeOzonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = self.server.page(self.path).encode()
+        time.sleep(self.server.latency)
+        with self.server._lock:
+            self.server.pages_served += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeOzonServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, items_per_page=36, churn_seconds=0.0, latency=0.0):
+        super().__init__(("127.0.0.1", 0), FakeOzonHandler)
+        self.items_per_page = items_per_page
+        self.churn_seconds = churn_seconds  # Как часто меняются цены (0 - никогда)
+        self.latency = latency
+        self.pages_served = 0
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def page_url(self, index):
+        return f"{self.url}/category/loadtest-{index}/"
+
+    # Страница выдачи: карточки товаров и JSON-состояние, как на настоящем Ozon
+    def page(self, path):
+        seed = zlib.crc32(path.encode()) % 100000
+        epoch = int((time.monotonic() - self._started) / self.churn_seconds) if self.churn_seconds else 0
+        items = []
+        cards = []
+        for index in range(self.items_per_page):
+            product = f"/product/loadtest-{seed}-{index}/"
+            price = f"{1000 + (seed * 7 + index * 13 + epoch * 100) % 5000} ₽"
+            image = f"https://cdn.example/{seed}/{index}.jpg"
+            items.append({
+                "action": {"link": product},
+                "mainState": [{"atom": {"type": "priceV2", "priceV2": {"price": [{"text": price, "textStyle": "PRICE"}]}}}],
+                "tileImage": {"items": [{"type": "image", "image": {"link": image}}]},
+            })
+            cards.append(
+                f'<div data-index="{index}"><a data-prerender="true" href="{product}">'
+                f'<img loading="lazy" src="{image}"></a><span class="tsHeadline500Medium">{price}</span></div>'
+            )
+        state = json.dumps({"items": items}, ensure_ascii=False).replace("'", "&#39;")
+        return (
+            "<html><head><meta charset=\"utf-8\"></head><body>"
+            f"<div id=\"state-searchResultsV2-1-default-1\" data-state='{state}'></div>"
+            + "".join(cards)
+            + "</body></html>"
+        )
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-ozon", daemon=True).start()
+        return self
+
+# Поддельный yt-dlp: пишет FAKE_YTDLP_SIZE байт за FAKE_YTDLP_DELAY секунд в файл из -o
+# (или в stdout для "-o -"), на --simulate печатает длительность и размер, на -J - форматы.
+# Размер 720p со звуком равен FAKE_YTDLP_SIZE, остальные форматы меньше в заданное число раз
+FAKE_YT_DLP = """#!{python}
+import json, os, sys, time
+args = sys.argv[1:]
+size = int(os.environ.get("FAKE_YTDLP_SIZE", "10000000"))
+delay = float(os.environ.get("FAKE_YTDLP_DELAY", "0"))
+duration = size / int(os.environ.get("FAKE_BYTES_PER_SECOND", "1000000"))
+# format_id, высота, vcodec, acodec, ext, доля размера
+formats = [
+    ("136", 720, "avc1", "none", "mp4", 0.9),
+    ("135", 480, "avc1", "none", "mp4", 0.45),
+    ("134", 360, "avc1", "none", "mp4", 0.25),
+    ("160", 144, "avc1", "none", "mp4", 0.08),
+    ("18", 360, "avc1", "mp4a", "mp4", 0.3),
+    ("140", None, "none", "mp4a", "m4a", 0.1),
+]
+shares = dict((fmt[0], fmt[5]) for fmt in formats)
+if "-J" in args:
+    # Как у настоящего yt-dlp: одна строка JSON в сотни КБ (длинные URL, фрагменты DASH, миниатюры)
+    keys = ("format_id", "height", "vcodec", "acodec", "ext")
+    url = "https://rr1---sn-fake.googlevideo.com/videoplayback?expire=1700000000&sig=" + "A" * 1500
+    fragments = [dict(url=url[:200] + "&sq=%d" % i, duration=5.0) for i in range(300)]
+    result = [dict(zip(keys, fmt[:5]), filesize=int(size * fmt[5]), url=url, fragments=fragments,
+                   http_headers=dict(Accept="*/*")) for fmt in formats]
+    thumbnails = [dict(url="https://i.ytimg.com/vi/fake/%d.jpg" % i, id=str(i)) for i in range(40)]
+    print(json.dumps(dict(id="fake", duration=duration, formats=result, thumbnails=thumbnails,
+                          description="fake video " * 500)))
+    sys.exit(0)
+if "--simulate" in args:
+    print(duration, size)
+    sys.exit(0)
+selected = args[args.index("-f") + 1].split("+")
+if all(format_id in shares for format_id in selected):
+    size = int(size * sum(shares[format_id] for format_id in selected))
+    delay = delay * size / int(os.environ.get("FAKE_YTDLP_SIZE", "10000000"))
+output = args[args.index("-o") + 1]
+log = sys.stderr if output == "-" else sys.stdout
+target = sys.stdout.buffer if output == "-" else open(output, "wb")
+chunk = os.urandom(1 << 20)
+chunks = max(1, (size + len(chunk) - 1) // len(chunk))
+written = 0
+while written < size:
+    part = chunk[:size - written]
+    target.write(part)
+    target.flush()
+    written += len(part)
+    log.write("[download] %5.1f%% of %d bytes\\n" % (written * 100 / size, size))
+    log.flush()
+    time.sleep(delay / chunks)
+target.close()
+"""
+
+# Поддельный ffprobe: длительность файла из его размера или список пакетов
+# (25 кадров в секунду, ключевой кадр раз в 2 секунды, размеры одинаковые)
+FAKE_FFPROBE = """#!{python}
+import os, sys
+size = os.path.getsize(sys.argv[-1])
+bytes_per_second = int(os.environ.get("FAKE_BYTES_PER_SECOND", "1000000"))
+if not any(arg.startswith("stream=") for arg in sys.argv):
+    print(size / bytes_per_second)
+    sys.exit(0)
+packets = max(1, int(size / bytes_per_second * 25))
+for index in range(packets):
+    flags = "K__" if index % 50 == 0 else "___"
+    print("packet|stream_index=0|pts_time=%.6f|dts_time=%.6f|size=%d|flags=%s" % (index / 25, index / 25, size // packets, flags))
+print("stream|index=0|codec_type=video")
+"""
+
+# Поддельный ffmpeg с -f segment: режет вход (файл или pipe:0) по байтам, как по времени
+# (-segment_time или -segment_times), и дописывает готовые части в -segment_list, как настоящий
+FAKE_FFMPEG = """#!{python}
+import os, sys
+args = sys.argv[1:]
+value = lambda name: args[args.index(name) + 1]
+bytes_per_second = int(os.environ.get("FAKE_BYTES_PER_SECOND", "1000000"))
+if "-segment_times" in args:
+    cuts = [int(float(time) * bytes_per_second) for time in value("-segment_times").split(",")]
+    sizes = [end - start for start, end in zip([0] + cuts, cuts)]
+else:
+    sizes = []
+part_size = int(float(value("-segment_time")) * bytes_per_second) if "-segment_time" in args else None
+source = value("-i")
+pattern = args[-1]
+source_file = sys.stdin.buffer if source == "pipe:0" else open(source, "rb")
+with open(value("-segment_list"), "w") as segment_list:
+    index = 0
+    while True:
+        size = sizes[index] if index < len(sizes) else part_size
+        data = source_file.read(size or -1)
+        if not data:
+            break
+        path = pattern % index
+        with open(path, "wb") as part:
+            part.write(data)
+            while size and part.tell() < size:
+                data = source_file.read(size - part.tell())
+                if not data:
+                    break
+                part.write(data)
+        segment_list.write("%s,0,0\\n" % os.path.basename(path))
+        segment_list.flush()
+        index += 1
+"""
+
+def install_fake_tools(directory):
+    for name, script in (("yt-dlp", FAKE_YT_DLP), ("ffprobe", FAKE_FFPROBE), ("ffmpeg", FAKE_FFMPEG)):
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write(script.format(python=sys.executable))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = directory + os.pathsep + os.environ.get("PATH", "")
+
+# Сценарий для ozon_observe_tg: users x urls_per_user подписок на pages популярных страниц
+async def run_ozon(args, telegram):
+    site = FakeOzonServer(churn_seconds=args.churn).start()
+    workdir = tempfile.mkdtemp(prefix="ozon-loadtest-")
+
+    import ozon_observe_tg as ozon
+    ozon.logger.setLevel("WARNING")
+    ozon.TELEGRAM_API_URL = telegram.url
+    ozon.DB_FILE = os.path.join(workdir, "ozon.db")
+    ozon.URLS_FILE = os.path.join(workdir, "urls.txt")
+    ozon.FILE_ID_CACHE_FILE = os.path.join(workdir, "file_ids.json")
+    ozon.HISTORY_DIR = os.path.join(workdir, "price_history")
+    ozon.METRICS_PORT = None
+    ozon.DRIVER_POOL_SIZE = 0  # Поддельный сайт отдает JSON-состояние, браузер не нужен
+    ozon.POLL_INTERVAL_SECONDS = args.poll_interval
+    ozon.STARTUP_STAGGER_SECONDS = args.stagger
+    ozon.MAX_CONCURRENT_SCRAPES = args.concurrency
+    ozon.SCRAPE_BACKEND = args.scrape_backend
+    ozon.LOCAL_SCRAPE_WORKERS = args.workers
+
+    poll_latency = []
+    send_latency = []
+    loop_lag = []
+    await ozon.start_services()
+    ozon.scheduler.poll = record_latency(ozon.scheduler.poll, poll_latency)
+    ozon.delivery.call = record_latency(ozon.delivery.call, send_latency)
+    monitor = asyncio.create_task(monitor_loop_lag(loop_lag))
+
+    started = time.perf_counter()
+    for user in range(args.users):
+        user_id = str(100000 + user)
+        for slot in range(args.urls_per_user):
+            url = site.page_url(random.randrange(args.pages))
+            if ozon.is_subscribed(user_id, url):
+                continue
+            ozon.store.add(user_id, url)
+            ozon.subscribe(user_id, url, delay=random.uniform(0, args.stagger))
+    setup_seconds = time.perf_counter() - started
+
+    await asyncio.sleep(args.duration)
+    # Новые опросы больше не запускаем и ждем, пока уйдет все, что уже в очереди
+    ozon.scheduler_task.cancel()
+    await ozon.scheduler.close()
+    drain_started = time.perf_counter()
+    await ozon.delivery.queue.join()
+    drain_seconds = time.perf_counter() - drain_started
+    elapsed = time.perf_counter() - started
+
+    monitor.cancel()
+    await ozon.stop_services()
+    site.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    telegram_stats = telegram.stats()
+    sends = sum(telegram_stats["requests"].get(method, 0) for method in ("sendPhoto", "sendMediaGroup"))
+    return {
+        "scenario": {
+            "users": args.users,
+            "urls_per_user": args.urls_per_user,
+            "distinct_pages": args.pages,
+            "duration_s": args.duration,
+            "poll_interval_s": args.poll_interval,
+            "concurrency": args.concurrency,
+            "scrape_backend": args.scrape_backend,
+        },
+        "subscriptions": sum(len(users) for users in ozon.subscribers.values()),
+        "setup_s": round(setup_seconds, 3),
+        "drain_s": round(drain_seconds, 3),
+        "pages_fetched": site.pages_served,
+        "polls": latency_summary(poll_latency),
+        "telegram_calls": latency_summary(send_latency),
+        "sends_per_second": round(sends / elapsed, 2),
+        "file_id_cache": {"hits": ozon.file_ids.hits, "misses": ozon.file_ids.misses},
+        "telegram": telegram_stats,
+        "loop_lag": latency_summary(loop_lag),
+    }
+
+# Сценарий для youtube2tg: requests запросов на видео, concurrency из них одновременно
+async def run_youtube(args, telegram):
+    workdir = tempfile.mkdtemp(prefix="youtube-loadtest-")
+    install_fake_tools(workdir)
+    os.environ["FAKE_YTDLP_SIZE"] = str(args.video_size)
+    os.environ["FAKE_YTDLP_DELAY"] = str(args.download_delay)
+
+    import youtube2tg as yt
+    yt.WORK_DIR = workdir
+    yt.VIDEO_CACHE_FILE = os.path.join(workdir, "video_cache.json")
+    yt.PIPE_DOWNLOAD = args.pipe
+    yt.TELEGRAM_API_URL = telegram.url
+    yt.TOKEN = FAKE_TOKEN
+    yt.VIDEO_WORKERS = args.concurrency
+    if args.local_api:
+        yt.LOCAL_BOT_API_URL = telegram.url
+        yt.detect_bot_api()
+    yt.PROGRESS_INTERVAL = 1
+
+    job_latency = []
+    first_part_latency = []
+    loop_lag = []
+    submitted = {}  # ID пользователя -> время постановки видео в очередь
+    monitor = asyncio.create_task(monitor_loop_lag(loop_lag))
+    await yt.start_workers()
+
+    send_video = yt.send_video
+
+    async def timed_send_video(file_path, user_id, caption):
+        if user_id in submitted:
+            first_part_latency.append(time.perf_counter() - submitted.pop(user_id))
+        return await send_video(file_path, user_id, caption)
+
+    yt.send_video = timed_send_video
+
+    async def request(index):
+        started = time.perf_counter()
+        video = index % args.distinct_videos if args.distinct_videos else index
+        job = yt.VideoJob(f"https://www.youtube.com/watch?v=load{video:06d}", 100000 + index)
+        submitted[job.user_id] = started
+        await yt.job_queue.put(job)
+        await job.done.wait()
+        job_latency.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(request(index) for index in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    monitor.cancel()
+    await yt.stop_workers()
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    telegram_stats = telegram.stats()
+    return {
+        "scenario": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "video_size": args.video_size,
+            "download_delay_s": args.download_delay,
+            "pipe": args.pipe,
+            "distinct_videos": args.distinct_videos,
+            "local_api": args.local_api,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "jobs_per_minute": round(args.requests / elapsed * 60, 2),
+        "upload_mb_per_second": round(telegram_stats["bytes_received"] / elapsed / 1e6, 2),
+        "jobs": latency_summary(job_latency),
+        "first_part": latency_summary(first_part_latency),
+        "video_cache": {"hits": yt.video_cache.hits, "misses": yt.video_cache.misses},
+        "download_mb": round(sum(value for _, value in yt.download_bytes_total.samples()) / 1e6, 1),
+        "telegram": telegram_stats,
+        "loop_lag": latency_summary(loop_lag),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд для ozon_observe_tg и youtube2tg")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="Задержка ответа Bot API, секунд")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429")
+    parser.add_argument("--output", help="Файл для результатов (по умолчанию stdout)")
+    subparsers = parser.add_subparsers(dest="bot", required=True)
+
+    ozon_parser = subparsers.add_parser("ozon", help="Нагрузка на ozon_observe_tg")
+    ozon_parser.add_argument("--users", type=int, default=1000)
+    ozon_parser.add_argument("--urls-per-user", type=int, default=5)
+    ozon_parser.add_argument("--pages", type=int, default=500, help="Количество разных страниц Ozon")
+    ozon_parser.add_argument("--duration", type=float, default=60, help="Длительность прогона, секунд")
+    ozon_parser.add_argument("--poll-interval", type=float, default=30, help="Интервал опроса страницы, секунд")
+    ozon_parser.add_argument("--stagger", type=float, default=5, help="Разброс первых опросов, секунд")
+    ozon_parser.add_argument("--concurrency", type=int, default=8, help="Одновременных загрузок страниц")
+    ozon_parser.add_argument("--churn", type=float, default=20, help="Как часто меняются цены, секунд (0 - никогда)")
+    ozon_parser.add_argument("--scrape-backend", default="inline", choices=["inline", "local"],
+                             help="Загрузка страниц в процессе бота или через очередь заданий")
+    ozon_parser.add_argument("--workers", type=int, default=2, help="Обработчиков очереди для --scrape-backend local")
+
+    youtube_parser = subparsers.add_parser("youtube", help="Нагрузка на youtube2tg")
+    youtube_parser.add_argument("--requests", type=int, default=20)
+    youtube_parser.add_argument("--concurrency", type=int, default=2, help="Обработчиков видео (VIDEO_WORKERS)")
+    youtube_parser.add_argument("--video-size", type=int, default=10_000_000, help="Размер видео, байт")
+    youtube_parser.add_argument("--download-delay", type=float, default=0.5, help="Время скачивания, секунд")
+    youtube_parser.add_argument("--pipe", action="store_true", help="Скачивание через канал в ffmpeg (PIPE_DOWNLOAD)")
+    youtube_parser.add_argument("--local-api", action="store_true",
+                                help="Поддельный сервер ведет себя как свой сервер Bot API (отправка по пути к файлу)")
+    youtube_parser.add_argument("--distinct-videos", type=int, default=0,
+                                help="Сколько разных видео среди запросов (0 - все разные)")
+
+    args = parser.parse_args()
+    telegram = FakeTelegramServer(args.telegram_latency, args.rate_limit_ratio, args.retry_after).start()
+    runner = run_ozon if args.bot == "ozon" else run_youtube
+    result = asyncio.run(runner(args, telegram))
+    telegram.shutdown()
+
+    report = {
+        "bot": args.bot,
+        "version": _git_version(),
+        "timestamp": int(time.time()),
+        "telegram_latency_s": args.telegram_latency,
+        "rate_limit_ratio": args.rate_limit_ratio,
+        "result": result,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Простые метрики для обоих ботов: счетчики, показатели и гистограммы времени.
+# Отдаются в формате Prometheus по HTTP (/metrics) и в виде текста для команды /stats.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_registry = []  # Все созданные метрики в порядке создания
+_lock = threading.Lock()  # Метрики обновляются и из потоков браузера/загрузки
+
+# Метки в формате Prometheus: {name="value",...}
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def samples(self):
+        with _lock:
+            return list(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in self.samples():
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+    def summary(self):
+        return [f"{self.name}{_format_labels(labels)}: {value:g}" for labels, value in self.samples()]
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name, description, function=None):
+        super().__init__(name, description)
+        self.function = function  # Если задана, значение вычисляется при каждом чтении
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                return [((), self.function())]
+            except Exception as e:
+                logger.warning(f"Не удалось вычислить метрику {self.name}: {e}")
+                return []
+        return super().samples()
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0, "max": 0.0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+            state["max"] = max(state["max"], value)
+
+    def samples(self):
+        with _lock:
+            return [(labels, dict(state, counts=list(state["counts"]))) for labels, state in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, state in self.samples():
+            for bound, count in zip(self.buckets, state["counts"]):
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {state['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {state['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {state['count']}")
+        return lines
+
+    def summary(self):
+        lines = []
+        for labels, state in self.samples():
+            average = state["sum"] / state["count"] if state["count"] else 0
+            lines.append(
+                f"{self.name}{_format_labels(labels)}: n={state['count']}, "
+                f"среднее={average:.3f}, макс={state['max']:.3f}"
+            )
+        return lines
+
+# Декоратор: время выполнения функции (обычной или async) попадает в гистограмму
+def timed(histogram, **labels):
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, **labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+# Все метрики в текстовом формате Prometheus
+def render():
+    lines = []
+    with _lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Краткая сводка для команды /stats
+def summary():
+    lines = []
+    with _lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.extend(metric.summary())
+    return "\n".join(lines) or "Метрик пока нет."
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Запросы Prometheus не пишем в лог
+
+# Запуск HTTP-сервера с метриками в фоновом потоке
+def start_http_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    logger.info(f"Метрики доступны по адресу http://{host}:{port}/metrics")
+    return server
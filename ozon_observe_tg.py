@@ -1,14 +1,41 @@
 import logging
 import asyncio
+import bisect
+import functools
+import hashlib
+import html as html_lib
+import json
+import heapq
+import itertools
+import random
 import re
-import requests
+import sqlite3
+import os
+import struct
+import sys
+import time
+from array import array
+import httpx
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException, TimeoutException
 from bs4 import BeautifulSoup
+try:
+    from lxml import etree
+except ImportError:  # Без lxml используется более медленный разбор через BeautifulSoup
+    etree = None
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import metrics
+import scrape_queue
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 # Настроим логирование
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -20,13 +47,118 @@ httpx_logger = logging.getLogger("httpx")
 httpx_logger.setLevel(logging.WARNING)  # Показывать только предупреждения и ошибки
 
 TELEGRAM_TOKEN = '111:AAA'  # Токен бота
+METRICS_PORT = 9100  # Порт для метрик Prometheus (None - не запускать)
+TELEGRAM_API_URL = "https://api.telegram.org"  # Адрес Bot API
+DELIVERY_WORKERS = 32  # Количество параллельных отправителей (большинство из них ждет своей очереди по лимиту чата)
+DELIVERY_CONNECTIONS = 8  # Размер пула HTTP-соединений с Bot API
+GLOBAL_SEND_RATE = 30  # Не больше стольких сообщений в секунду на всех
+CHAT_SEND_INTERVAL = 1.0  # Минимальная пауза между сообщениями в один чат, секунд
+MAX_SEND_ATTEMPTS = 5  # Попыток отправки с учетом ответов 429
+ALBUM_SIZE = 10  # Максимум фотографий в одном альбоме (ограничение Telegram)
+FILE_ID_CACHE_FILE = "file_ids.json"  # Кэш file_id загруженных в Telegram картинок
+FILE_ID_CACHE_SIZE = 20000  # Сколько картинок помнить
+FILE_ID_SAVE_EVERY = 100  # Сохранять кэш на диск после стольких новых записей
+# Ответ Telegram на устаревший или чужой file_id (при других ошибках кэш не сбрасывается)
+WRONG_FILE_ID_PATTERN = re.compile(r"wrong (?:remote )?file (?:identifier|id)|WRONG_FILE_ID|FILE_REFERENCE_EXPIRED", re.IGNORECASE)
 LIMIT = 3  # Количество отправляемых сообщений
+OZON_BASE_URL = "https://www.ozon.ru"  # Префикс для относительных ссылок на товары
+PARSE_CHUNK_SIZE = 65536  # Размер порции HTML, которую получает потоковый парсер
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.5735.199 Safari/537.36"
+HTTP_FETCH_ENABLED = True  # Сначала пробовать загрузить страницу без браузера
+HTTP_FETCH_TIMEOUT = 15  # Таймаут загрузки страницы без браузера, секунд
+FETCH_STATS_SIZE = 5000  # Для скольких страниц помнить, каким способом они загружались
+FETCH_STATS_REPLY_PAGES = 10  # Сколько страниц показывать в /stats
+FETCH_STATS_LOG_INTERVAL = 3600  # Как часто ozon_worker.py пишет сводку по загрузкам страниц в лог, секунд
 POLL_INTERVAL_SECONDS = 14400 # Интервал ожидания в секундах
-URLS_FILE = "urls.txt"  # Файл для хранения URL
+POLL_INTERVALS = {}  # Собственные интервалы опроса: нормализованный URL -> секунды
+POLL_JITTER = 0.1  # Случайная добавка к интервалу (доля от интервала), чтобы опросы не совпадали
+STARTUP_STAGGER_SECONDS = 600  # Окно, по которому распределяются опросы после перезапуска
+MAX_CONCURRENT_SCRAPES = 2  # Сколько страниц может загружаться одновременно
+MAX_BACKOFF_SECONDS = 86400  # Максимальная пауза для страниц, которые постоянно не загружаются
+# Где загружаются страницы: "inline" - в процессе бота, "local" - через очередь заданий
+# и обработчики в этом же процессе, "redis" - через общую очередь и процессы ozon_worker.py
+SCRAPE_BACKEND = "inline"
+REDIS_URL = "redis://localhost:6379/0"  # Очередь заданий для SCRAPE_BACKEND = "redis"
+LOCAL_SCRAPE_WORKERS = 2  # Обработчиков в процессе бота для SCRAPE_BACKEND = "local"
+REMOTE_MAX_IN_FLIGHT = 64  # Сколько заданий может выполняться одновременно при работе через очередь
+SCRAPE_JOB_TIMEOUT = 300  # Сколько ждать результата задания из очереди, секунд
+WORKER_HEARTBEAT_INTERVAL = 5  # Как часто обработчик сообщает, что жив, секунд
+URLS_FILE = "urls.txt"  # Старый файл с URL, переносится в базу при первом запуске
+DB_FILE = "ozon.db"  # База данных с подписками
+PRICE_CHANGE_THRESHOLD = 0.05  # Минимальное изменение цены (доля), о котором сообщаем
+SNAPSHOT_TTL_DAYS = 30  # Через сколько дней забываем товары, пропавшие из выдачи
+HISTORY_DIR = "price_history"  # Каталог с историей цен (по файлу на товар)
+HISTORY_MIN_INTERVAL = 86400  # Неизменившаяся цена записывается не чаще, секунд
+HISTORY_RAW_DAYS = 30  # Сколько дней хранить все точки; более старые прореживаются
+HISTORY_BUCKET_SECONDS = 86400  # При прореживании остаются минимум и максимум за такой интервал
+HISTORY_RETENTION_DAYS = 365  # Точки старше удаляются
+HISTORY_COMPACT_INTERVAL = 86400  # Как часто прореживать историю, секунд
+HISTORY_REPLY_POINTS = 20  # Сколько последних точек показывать в /history
+HISTORY_LAST_POINTS_CACHE = 50000  # Для скольких товаров помнить последнюю точку (остальные читаются с диска)
+CHROMEDRIVER_PATH = "/path/to/chromedriver/chromedriver"  # Путь к chromedriver
+DRIVER_POOL_SIZE = 2  # Количество одновременно запущенных браузеров
+DRIVER_MAX_PAGES = 50  # Через сколько страниц браузер перезапускается
+PAGE_READY_TIMEOUT = 15  # Сколько ждать появления карточек товаров, секунд
+PAGE_LOAD_TIMEOUT = 60  # Предельное время загрузки страницы браузером, секунд
+LEAN_RENDER = True  # Облегченный режим браузера: не загружать картинки, шрифты, видео и аналитику
+LEAN_WINDOW_SIZE = "1280,800"  # Размер окна в облегченном режиме (карточки LIMIT помещаются на первом экране)
+# Что блокируется в облегченном режиме (шаблоны Network.setBlockedURLs). Ссылки на картинки
+# остаются в атрибутах src, поэтому сами картинки загружать не нужно.
+BLOCKED_URL_PATTERNS = [
+    "*.jpg", "*.jpeg", "*.png", "*.webp", "*.avif", "*.gif", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp4", "*.webm", "*.m3u8",
+]
+BLOCKED_DOMAINS = [
+    "*mc.yandex.ru*", "*yandex.ru/metrika*", "*google-analytics.com*", "*googletagmanager.com*",
+    "*doubleclick.net*", "*top-fwz1.mail.ru*", "*vk.com/rtrg*", "*criteo.com*", "*adfox.ru*",
+]
+TRACK_PAGE_TRAFFIC = True  # Считать трафик и запросы браузера на каждую страницу
 OZON_URL_PATTERN = re.compile(r"^https:\/\/(?:www\.)?ozon\.ru\/(?:category|search|collection|brand)\/", re.IGNORECASE)
+# Параметры, которые не влияют на выдачу и отбрасываются при нормализации URL
+TRACKING_PARAMS = {"from", "__rr", "abt_att", "origin_referer", "miniapp", "sh", "oos_search", "layout_container", "layout_page_index"}
 
 allowed_ids = []  # Список разрешенных ID пользователей
-active_tasks = {}  # Список активных задач для пользователей
+admin_ids = []  # Список администраторов (доступна команда /stats)
+active_tasks = {}  # Список отслеживаемых URL для пользователей
+subscribers = {}  # Нормализованный URL -> {ID пользователя: URL в том виде, в котором его прислали}
+scheduler = None  # Планировщик опросов, создается при запуске бота
+scheduler_task = None  # Задача, в которой работает планировщик
+store = None  # Хранилище подписок, открывается при запуске бота
+snapshots = None  # Последние увиденные товары и цены по каждой странице
+delivery = None  # Очередь отправки сообщений в Telegram
+first_deliveries = set()  # (ID пользователя, URL), для которых вся выдача в очереди на отправку, но еще не отправлена
+file_ids = None  # Кэш file_id картинок товаров
+price_history = None  # История цен товаров, открывается при запуске бота
+ozon_http = None  # HTTP-клиент для загрузки страниц без браузера
+fetch_stats = OrderedDict()  # Нормализованный URL -> сколько раз страница загружена по http, браузером или не загружена, трафик браузера
+browser_executor = None  # Потоки для блокирующих вызовов Selenium, создаются при запуске
+parse_executor = None  # Потоки для разбора страниц, загруженных без браузера, создаются при запуске
+scrape_jobs = None  # Очередь заданий на загрузку страниц (если страницы загружаются не в процессе бота)
+background_tasks = []  # Обработчики очереди и проверка обработчиков
+driver_pool = None  # Пул браузеров, создается при запуске бота
+
+# Метрики
+browser_launch_seconds = metrics.Histogram("ozon_browser_launch_seconds", "Время запуска Chrome")
+page_render_seconds = metrics.Histogram("ozon_page_render_seconds", "Время загрузки страницы в браузере")
+page_parse_seconds = metrics.Histogram("ozon_page_parse_seconds", "Время извлечения товаров из HTML")
+page_fetch_seconds = metrics.Histogram("ozon_page_fetch_seconds", "Полное время получения выдачи одной страницы")
+page_fetch_total = metrics.Counter("ozon_page_fetch_total", "Загрузки страниц по способу (http, browser, failed)")
+telegram_send_seconds = metrics.Histogram("ozon_telegram_send_seconds", "Время отправки в Telegram")
+page_transfer_bytes = metrics.Histogram(
+    "ozon_page_transfer_bytes", "Трафик браузера на одну страницу, байт",
+    buckets=(100e3, 250e3, 500e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6),
+)
+page_requests = metrics.Histogram(
+    "ozon_page_requests", "Запросов браузера на одну страницу", buckets=(10, 25, 50, 100, 200, 400, 800),
+)
+page_blocked_requests_total = metrics.Counter("ozon_page_blocked_requests_total", "Запросы, заблокированные облегченным режимом")
+metrics.Gauge("ozon_tracked_urls", "Количество опрашиваемых страниц", lambda: len(scheduler) if scheduler else 0)
+metrics.Gauge("ozon_subscriptions", "Количество активных подписок", lambda: sum(len(users) for users in subscribers.values()))
+metrics.Gauge("ozon_delivery_queue_depth", "Сообщений в очереди на отправку", lambda: delivery.queue.qsize() if delivery else 0)
+metrics.Gauge("ozon_file_id_cache_hits", "Попадания в кэш file_id картинок", lambda: file_ids.hits if file_ids else 0)
+metrics.Gauge("ozon_file_id_cache_misses", "Промахи кэша file_id картинок", lambda: file_ids.misses if file_ids else 0)
+history_points_total = metrics.Counter("ozon_history_points_total", "Записано точек истории цен")
 
 # Универсальная функция для работы с файлами
 def read_file_lines(filename):
@@ -43,135 +175,1153 @@ def load_allowed_ids():
     allowed_ids = [line.strip() for line in read_file_lines("ids.txt")]
     logger.info("Файл ids.txt успешно загружен.")
 
+# Функция для загрузки ID администраторов из файла
+def load_admin_ids():
+    global admin_ids
+    admin_ids = [line.strip() for line in read_file_lines("admins.txt")]
+    logger.info("Файл admins.txt успешно загружен.")
+
+# Хранилище подписок в SQLite (режим WAL).
+# Строки индексируются по пользователю и по нормализованному URL,
+# поэтому любое изменение затрагивает одну строку, а не весь файл.
+class SubscriptionStore:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS subscriptions ("
+                "user_id TEXT NOT NULL, url TEXT NOT NULL, norm_url TEXT NOT NULL, last_sent TEXT, "
+                "PRIMARY KEY (user_id, url))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS subscriptions_norm_url ON subscriptions (norm_url)")
+
+    # Одноразовый перенос подписок из файла формата user|url|timestamp
+    def migrate_from_file(self, filename):
+        if not os.path.exists(filename):
+            return
+        rows = []
+        for line in read_file_lines(filename):
+            line = line.strip()
+            if not line or "|" not in line:
+                continue
+            try:
+                user_id, url, timestamp = line.split("|", 2)
+            except ValueError:
+                logger.warning(f"Некорректная строка в файле: {line}")
+                continue
+            rows.append((user_id, url, normalize_url(url), timestamp or None))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO subscriptions (user_id, url, norm_url, last_sent) VALUES (?, ?, ?, ?)", rows
+            )
+        os.replace(filename, filename + ".migrated")
+        logger.info(f"Из файла {filename} перенесено подписок: {len(rows)}.")
+
+    def add(self, user_id, url, last_sent=None):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO subscriptions (user_id, url, norm_url, last_sent) VALUES (?, ?, ?, ?)",
+                (user_id, url, normalize_url(url), last_sent),
+            )
+
+    # Удаляет подписку пользователя на страницу (с точностью до нормализации) и возвращает удаленные URL
+    def remove(self, user_id, url):
+        key = normalize_url(url)
+        with self.conn:
+            urls = [row[0] for row in self.conn.execute(
+                "SELECT url FROM subscriptions WHERE user_id = ? AND norm_url = ?", (user_id, key)
+            )]
+            self.conn.execute("DELETE FROM subscriptions WHERE user_id = ? AND norm_url = ?", (user_id, key))
+        return urls
+
+    def remove_user(self, user_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM subscriptions WHERE user_id = ?", (user_id,))
+
+    # Список (URL, время последней отправки) для пользователя
+    def list_for_user(self, user_id):
+        return self.conn.execute(
+            "SELECT url, last_sent FROM subscriptions WHERE user_id = ? ORDER BY rowid", (user_id,)
+        ).fetchall()
+
+    # Подписчики страницы, которым еще ничего не отправлялось
+    def pending_users(self, key):
+        return {row[0] for row in self.conn.execute(
+            "SELECT user_id FROM subscriptions WHERE norm_url = ? AND last_sent IS NULL", (key,)
+        )}
+
+    # Все подписки в виде (ID пользователя, URL)
+    def all(self):
+        return self.conn.execute("SELECT user_id, url FROM subscriptions ORDER BY rowid").fetchall()
+
+    def touch(self, user_id, url, timestamp):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE subscriptions SET last_sent = ? WHERE user_id = ? AND url = ?", (timestamp, user_id, url)
+            )
+
+    def close(self):
+        self.conn.close()
+
+# Последний снимок выдачи по каждой странице: цены товаров и отпечаток всей выдачи.
+# Если отпечаток не изменился, страница дальше не обрабатывается.
+class SnapshotStore:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "norm_url TEXT NOT NULL, product_url TEXT NOT NULL, price INTEGER, seen_at REAL NOT NULL, "
+                "PRIMARY KEY (norm_url, product_url))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints (norm_url TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)"
+            )
+
+    def fingerprint(self, key):
+        row = self.conn.execute("SELECT fingerprint FROM fingerprints WHERE norm_url = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    # Сравнивает выдачу с прошлым снимком, сохраняет новый снимок
+    # и возвращает новые товары и товары с заметно изменившейся ценой.
+    # Запомненная цена меняется только у новых товаров и после сообщения об изменении,
+    # иначе цена, которая понемногу меняется от опроса к опросу, никогда не превысит порог
+    def update(self, key, items, fingerprint):
+        now = time.time()
+        known = dict(self.conn.execute("SELECT product_url, price FROM snapshots WHERE norm_url = ?", (key,)))
+        changes = []
+        priced = []  # Товары, для которых запоминается текущая цена
+        seen = []  # Остальные товары: обновляется только время, когда их видели
+        for item in items:
+            price = parse_price(item["price"])
+            if item["url"] not in known:
+                changes.append(item)
+                priced.append((key, item["url"], price, now))
+                continue
+            old_price = known[item["url"]]
+            if price is not None and old_price and abs(price - old_price) / old_price >= PRICE_CHANGE_THRESHOLD:
+                changes.append(dict(item, old_price=old_price))
+                priced.append((key, item["url"], price, now))
+            elif price is not None and not old_price:
+                priced.append((key, item["url"], price, now))
+            else:
+                seen.append((now, key, item["url"]))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO snapshots (norm_url, product_url, price, seen_at) VALUES (?, ?, ?, ?)", priced
+            )
+            self.conn.executemany("UPDATE snapshots SET seen_at = ? WHERE norm_url = ? AND product_url = ?", seen)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fingerprints (norm_url, fingerprint) VALUES (?, ?)", (key, fingerprint)
+            )
+            self.conn.execute(
+                "DELETE FROM snapshots WHERE norm_url = ? AND seen_at < ?", (key, now - SNAPSHOT_TTL_DAYS * 86400)
+            )
+        return changes
+
+    def close(self):
+        self.conn.close()
+
+# История цен: по файлу на товар, в файле подряд записи (время, цена) по 8 байт -
+# uint32 и float32 (цены в рублях до 16 млн хранятся точно). Новые точки только дописываются
+# в конец, поэтому запись дешевая, а ряд читается в два массива без разбора по строкам.
+# Старые точки периодически прореживаются до минимума и максимума за HISTORY_BUCKET_SECONDS.
+HISTORY_RECORD = struct.Struct("<If")
+PRODUCT_ID_PATTERN = re.compile(r"/product/(?:[^/?]*-)?(\d+)/?(?:\?|$)")
+
+class PriceHistory:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._last = OrderedDict()  # Путь к файлу -> (время, цена) последней точки, вытесняются давно не виденные
+
+    # Файл товара: по ID товара из ссылки, чтобы разные варианты ссылки вели к одной истории
+    def path(self, product_url):
+        match = PRODUCT_ID_PATTERN.search(product_url)
+        name = match.group(1) if match else hashlib.blake2b(product_url.encode(), digest_size=10).hexdigest()
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def _last_point(self, path):
+        if path in self._last:
+            self._last.move_to_end(path)
+        else:
+            point = None
+            try:
+                with open(path, "rb") as f:
+                    f.seek(0, os.SEEK_END)
+                    end = f.tell() - f.tell() % HISTORY_RECORD.size
+                    if end:
+                        f.seek(end - HISTORY_RECORD.size)
+                        point = HISTORY_RECORD.unpack(f.read(HISTORY_RECORD.size))
+            except FileNotFoundError:
+                pass
+            self._remember(path, point)
+        return self._last[path]
+
+    def _remember(self, path, point):
+        self._last[path] = point
+        self._last.move_to_end(path)
+        while len(self._last) > HISTORY_LAST_POINTS_CACHE:
+            self._last.popitem(last=False)
+
+    # Дописывает цены товаров из выдачи; неизменившаяся цена пишется не чаще HISTORY_MIN_INTERVAL
+    def record(self, items, now=None):
+        now = int(now or time.time())
+        for item in items:
+            price = parse_price(item["price"])
+            if price is None:
+                continue
+            path = self.path(item["url"])
+            last = self._last_point(path)
+            if last and last[1] == price and now - last[0] < HISTORY_MIN_INTERVAL:
+                continue
+            with open(path, "ab") as f:
+                f.write(HISTORY_RECORD.pack(now, price))
+            self._remember(path, (now, float(price)))
+            history_points_total.inc()
+
+    def _read_path(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return array("I"), array("f")
+        data = data[:len(data) - len(data) % HISTORY_RECORD.size]  # Недописанная запись после сбоя
+        times, prices = array("I"), array("f")
+        times.frombytes(data)
+        prices.frombytes(data)
+        if sys.byteorder == "big":
+            times.byteswap()
+            prices.byteswap()
+        return times[0::2], prices[1::2]
+
+    # Ряд цен товара: массив времен и массив цен
+    def read(self, product_url):
+        return self._read_path(self.path(product_url))
+
+    # Прореживание и удаление старых точек одного файла; возвращает True, если файл изменился
+    def compact_file(self, path, now=None):
+        now = now or time.time()
+        times, prices = self._read_path(path)
+        expire_before = now - HISTORY_RETENTION_DAYS * 86400
+        raw_after = now - HISTORY_RAW_DAYS * 86400
+        if not times or times[0] >= raw_after:
+            return False
+
+        points = []
+        bucket, bucket_points = None, []
+
+        def flush_bucket():
+            if bucket_points:
+                low = min(bucket_points, key=lambda point: point[1])
+                high = max(bucket_points, key=lambda point: point[1])
+                points.extend(sorted({low, high}))
+
+        for point in zip(times, prices):
+            if point[0] < expire_before:
+                continue
+            if point[0] >= raw_after:
+                flush_bucket()
+                bucket_points = []
+                points.append(point)
+                continue
+            if point[0] // HISTORY_BUCKET_SECONDS != bucket:
+                flush_bucket()
+                bucket, bucket_points = point[0] // HISTORY_BUCKET_SECONDS, []
+            bucket_points.append(point)
+        flush_bucket()
+
+        if len(points) == len(times):
+            return False
+        if not points:
+            os.remove(path)
+            self._last.pop(path, None)
+            return True
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(HISTORY_RECORD.pack(*point) for point in points))
+        os.replace(tmp_path, path)
+        if path in self._last:
+            self._last[path] = points[-1]
+        return True
+
+    # Прореживание всей истории; запись новых точек в это время продолжается в том же потоке
+    async def compact(self):
+        changed = 0
+        for index, name in enumerate(os.listdir(self.directory)):
+            if name.endswith(".bin") and self.compact_file(os.path.join(self.directory, name)):
+                changed += 1
+            if index % 100 == 99:
+                await asyncio.sleep(0)
+        logger.info(f"История цен прорежена, изменено файлов: {changed}.")
+
+# Периодическое прореживание истории цен
+async def run_history_compaction():
+    while True:
+        try:
+            await price_history.compact()
+        except Exception as e:
+            logger.error(f"Ошибка при прореживании истории цен: {e}")
+        await asyncio.sleep(HISTORY_COMPACT_INTERVAL)
+
+# Цена в рублях из строки вида "12 345 ₽"
+def parse_price(text):
+    digits = re.sub(r"\D", "", text or "")
+    return int(digits) if digits else None
+
+# Отпечаток выдачи: ссылки и цены товаров в порядке выдачи
+def listing_fingerprint(items):
+    digest = hashlib.blake2b(digest_size=16)
+    for item in items:
+        digest.update(f"{item['url']}|{item['price']}\n".encode())
+    return digest.hexdigest()
+
+# Текст сообщения о товаре
+def format_item(item):
+    message = f"Ссылка: {item['url']}\nЦена: {item['price']}"
+    if item.get("old_price"):
+        message += f" (было {item['old_price']} ₽)"
+    return message
+
 #Получает URL и время последней отправки для пользователя.
 def get_url_for_user(user_id):
-    try:
-        with open(URLS_FILE, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or "|" not in line:  # Пропускаем некорректные строки
-                    logger.warning(f"Некорректная строка в файле: {line}")
-                    continue
-                try:
-                    stored_user_id, stored_url, _ = line.split("|", 2)  # Игнорируем дату
-                    if stored_user_id == user_id:
-                        return stored_url, _  # Возвращаем URL и дату (если нужна)
-                except ValueError as e:
-                    logger.error(f"Ошибка при обработке строки: {line}. Детали: {e}")
-    except FileNotFoundError:
-        logger.error("Файл urls.txt не найден.")
+    rows = store.list_for_user(user_id)
+    if rows:
+        return rows[0]
     return None, None
 
-# Восстановление задач из файла
+# Приведение URL к единому виду: одинаковые страницы с разным порядком
+# параметров или с параметрами отслеживания дают один и тот же ключ
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host == "ozon.ru":
+        host = "www.ozon.ru"
+    path = parts.path.rstrip("/") + "/"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith("utm_")
+    )
+    return urlunsplit((parts.scheme.lower(), host, path, urlencode(query), ""))
+
+# Подписка пользователя на URL. Страница опрашивается один раз на всех подписчиков.
+# delay - через сколько секунд выполнить первый опрос новой страницы.
+def subscribe(user_id, url, delay=0):
+    key = normalize_url(url)
+    subscribers.setdefault(key, {})[user_id] = url
+    active_tasks.setdefault(user_id, []).append(url)
+    # Для новой подписки опрашиваем страницу сразу, даже если у нее уже есть подписчики
+    if key not in scheduler or delay == 0:
+        scheduler.add(key, delay=delay)
+
+# Отписка пользователя от URL. Опрос страницы останавливается, когда не остается подписчиков.
+def unsubscribe(user_id, url):
+    key = normalize_url(url)
+    users = subscribers.get(key, {})
+    users.pop(user_id, None)
+    if not users:
+        subscribers.pop(key, None)
+        fetch_stats.pop(key, None)
+        scheduler.remove(key)
+    user_urls = active_tasks.get(user_id, [])
+    if url in user_urls:
+        user_urls.remove(url)
+    if not user_urls:
+        active_tasks.pop(user_id, None)
+
+# Проверка, подписан ли пользователь на эту страницу (с точностью до нормализации)
+def is_subscribed(user_id, url):
+    return user_id in subscribers.get(normalize_url(url), {})
+
+# Восстановление задач из базы
 async def restore_tasks():
-    try:
-        with open(URLS_FILE, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or "|" not in line:
-                    continue
-                try:
-                    user_id, url, _ = line.split("|", 2)
-                    if user_id in allowed_ids:
-                        task = asyncio.create_task(send_results(user_id, url))
-                        if user_id not in active_tasks:
-                            active_tasks[user_id] = []
-                        active_tasks[user_id].append((task, url))
-                        logger.info(f"Восстановлено отслеживание для пользователя {user_id} по URL: {url}")
-                except ValueError as e:
-                    logger.error(f"Ошибка при восстановлении строки: {line}. Детали: {e}")
-    except FileNotFoundError:
-        logger.warning("Файл urls.txt не найден. Восстанавливать нечего.")
+    for user_id, url in store.all():
+        if user_id in allowed_ids and not is_subscribed(user_id, url):
+            # Разносим первые опросы по времени, чтобы не запускать все браузеры разом
+            subscribe(user_id, url, delay=random.uniform(0, STARTUP_STAGGER_SECONDS))
+            logger.info(f"Восстановлено отслеживание для пользователя {user_id} по URL: {url}")
 
-# Парсинг страницы
-async def parse_page(url):
+# Запуск нового экземпляра Chrome
+@metrics.timed(browser_launch_seconds)
+def create_driver():
     options = Options()
     options.add_argument("--headless")
-    options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.5735.199 Safari/537.36")
+    options.add_argument(f"user-agent={USER_AGENT}")
     options.add_argument("--disable-blink-features=AutomationControlled")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-gpu")
-    options.add_argument("--window-size=1920,1080")
+    if LEAN_RENDER:
+        options.add_argument(f"--window-size={LEAN_WINDOW_SIZE}")
+        options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    else:
+        options.add_argument("--window-size=1920,1080")
+    if TRACK_PAGE_TRAFFIC:
+        # События Network.* из журнала производительности нужны для подсчета трафика
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    # Не ждем загрузки всех ресурсов: готовность страницы определяется по карточкам товаров
+    options.page_load_strategy = "eager"
 
-    service = Service("/path/to/chromedriver/chromedriver")
+    service = Service(CHROMEDRIVER_PATH)
     driver = webdriver.Chrome(service=service, options=options)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    if LEAN_RENDER:
+        # Блокировка по шаблонам действует на все последующие переходы в этой вкладке
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS + BLOCKED_DOMAINS})
+    return driver
 
-    results = []
+# Трафик страницы по журналу производительности Chrome: (байт, запросов, заблокировано).
+# Журнал очищается при каждом чтении.
+def read_page_traffic(driver):
+    transferred = requests_made = blocked = 0
+    for entry in driver.get_log("performance"):
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        method = message.get("method")
+        if method == "Network.requestWillBeSent":
+            requests_made += 1
+        elif method == "Network.loadingFinished":
+            transferred += message.get("params", {}).get("encodedDataLength", 0)
+        elif method == "Network.loadingFailed" and message.get("params", {}).get("blockedReason"):
+            blocked += 1
+    return transferred, requests_made, blocked
+
+# Выполнение блокирующей функции в потоках браузера
+def run_in_browser_thread(func, *args):
+    return asyncio.get_running_loop().run_in_executor(browser_executor, functools.partial(func, *args))
+
+# Загрузка страницы и извлечение товаров (выполняется в потоке браузера).
+# Ожидание заканчивается, как только на странице появляются карточки с data-index.
+# Возвращает товары и трафик страницы (или None, если трафик не считается).
+@metrics.timed(page_render_seconds)
+def render_page(driver, url):
+    if TRACK_PAGE_TRAFFIC:
+        read_page_traffic(driver)  # Сбрасываем события, оставшиеся от прошлой страницы
+    driver.get(url)
     try:
-        driver.get(url)
-        await asyncio.sleep(5)
-        soup = BeautifulSoup(driver.page_source, "html.parser")
+        WebDriverWait(driver, PAGE_READY_TIMEOUT).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, "div[data-index]"))
+        )
+    except TimeoutException:
+        logger.warning(f"Карточки товаров на странице {url} не появились за {PAGE_READY_TIMEOUT} с.")
+    items = extract_items(driver.page_source.encode())
+    traffic = read_page_traffic(driver) if TRACK_PAGE_TRAFFIC else None
+    return items, traffic
 
-        # Ищем все элементы с тегом <div> и атрибутом data-index
-        items = soup.find_all("div", attrs={"data-index": True}, limit=LIMIT)
+# Проверка, что браузер еще отвечает
+def is_driver_alive(driver):
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
 
-        for item in items:
-            link_tag = item.find("a", attrs={"data-prerender": "true"})
-            if link_tag and link_tag.has_attr("href"):
-                full_url = "https://www.ozon.ru" + link_tag["href"].split("?")[0]
+# Закрытие браузера без выброса исключений
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        logger.warning(f"Ошибка при закрытии браузера: {e}")
+
+# Пул заранее запущенных браузеров.
+# Браузер выдается через acquire() и возвращается через release().
+# Если все браузеры заняты, ожидающие встают в очередь (Semaphore обслуживает их по порядку).
+class DriverPool:
+    def __init__(self, size, max_pages):
+        self.size = size
+        self.max_pages = max_pages
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []  # Свободные браузеры
+        self._pages = {}  # Количество обработанных страниц для каждого браузера
+
+    async def _spawn(self):
+        driver = await run_in_browser_thread(create_driver)
+        self._pages[driver] = 0
+        return driver
+
+    async def _discard(self, driver):
+        self._pages.pop(driver, None)
+        await run_in_browser_thread(quit_driver, driver)
+
+    # Прогрев пула: запускаем браузеры заранее, до первого опроса
+    async def start(self):
+        for _ in range(self.size):
+            try:
+                self._idle.append(await self._spawn())
+            except Exception as e:
+                logger.error(f"Не удалось запустить браузер при прогреве пула: {e}")
+        logger.info(f"Пул браузеров запущен: {len(self._idle)} из {self.size}.")
+
+    async def acquire(self):
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                driver = self._idle.pop()
+                if await run_in_browser_thread(is_driver_alive, driver):
+                    return driver
+                logger.warning("Браузер из пула не отвечает, перезапускаем.")
+                await self._discard(driver)
+            return await self._spawn()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    # broken=True означает, что браузер упал и его нужно заменить
+    async def release(self, driver, broken=False):
+        try:
+            self._pages[driver] = self._pages.get(driver, 0) + 1
+            if broken or self._pages[driver] >= self.max_pages:
+                await self._discard(driver)
             else:
+                self._idle.append(driver)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        while self._idle:
+            await self._discard(self._idle.pop())
+
+# Данные карточки товара из элементов ссылки, цены и картинки
+def make_item(href, price, img_url):
+    return {
+        "url": OZON_BASE_URL + href.split("?")[0],
+        "price": price or "Цена не найдена",
+        "img": img_url,
+    }
+
+# Извлечение карточек товаров через BeautifulSoup: строит дерево всей страницы
+def extract_items_bs4(html, limit=LIMIT):
+    soup = BeautifulSoup(html, "html.parser")
+    results = []
+
+    # Ищем все элементы с тегом <div> и атрибутом data-index
+    for item in soup.find_all("div", attrs={"data-index": True}, limit=limit):
+        link_tag = item.find("a", attrs={"data-prerender": "true"})
+        if not link_tag or not link_tag.has_attr("href"):
+            continue
+        price_tag = item.find("span", class_="tsHeadline500Medium")
+        img_tag = item.find("img", attrs={"loading": ("eager", "lazy")})
+        results.append(make_item(
+            link_tag["href"],
+            price_tag.text.strip() if price_tag else None,
+            img_tag["src"] if img_tag and img_tag.has_attr("src") else None,
+        ))
+    return results
+
+# Разбор одной карточки (элемента lxml)
+def _parse_card(card):
+    link_tag = next((a for a in card.iter("a") if a.get("data-prerender") == "true"), None)
+    if link_tag is None or link_tag.get("href") is None:
+        return None
+    price_tag = next(
+        (span for span in card.iter("span") if "tsHeadline500Medium" in (span.get("class") or "").split()), None
+    )
+    img_tag = next((img for img in card.iter("img") if img.get("loading") in ("eager", "lazy")), None)
+    return make_item(
+        link_tag.get("href"),
+        "".join(price_tag.itertext()).strip() if price_tag is not None else None,
+        img_tag.get("src") if img_tag is not None else None,
+    )
+
+# Извлечение карточек товаров из HTML (bytes в UTF-8).
+# Страница подается потоковому парсеру lxml порциями; разбор останавливается,
+# как только прочитано limit карточек, а уже ненужные элементы сразу освобождаются.
+# Вложенные элементы с data-index считаются частью внешней карточки.
+@metrics.timed(page_parse_seconds, parser="cards")
+def extract_items(html, limit=LIMIT):
+    if etree is None:
+        return extract_items_bs4(html, limit)
+
+    parser = etree.HTMLPullParser(events=("start", "end"), encoding="utf-8")
+    results = []
+    cards = 0
+    card = None  # Карточка, которая сейчас читается
+    for offset in range(0, len(html), PARSE_CHUNK_SIZE):
+        parser.feed(html[offset:offset + PARSE_CHUNK_SIZE])
+        for event, element in parser.read_events():
+            if event == "start":
+                if card is None and element.tag == "div" and element.get("data-index") is not None:
+                    card = element
+                continue
+            if element is not card:
+                if card is None:
+                    # Вне карточек дерево не нужно: освобождаем память
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+                continue
+            item = _parse_card(card)
+            if item:
+                results.append(item)
+            card.clear()
+            card = None
+            cards += 1
+            if cards >= limit:
+                return results
+    return results
+
+# Блоки состояния с выдачей, которые Ozon встраивает в страницу: <div id="state-searchResultsV2-..." data-state='{...}'>.
+# Значения атрибутов в кавычках пропускаются целиком: в них может встретиться ">"
+_TAG_CHAR = rb"""(?:[^>"']|"[^"]*"|'[^']*')"""  # Символ тега вне кавычек или значение в кавычках целиком
+STATE_TAG_PATTERN = re.compile(
+    rb'<div\b' + _TAG_CHAR + rb'*?\sid="state-(?:searchResultsV2|tileGridDesktop)[^"]*"' + _TAG_CHAR + rb'*>'
+)
+STATE_ATTR_PATTERN = re.compile(rb"""data-state=(?:'([^']*)'|"([^"]*)")""")
+
+# Цена товара из блока состояния: сначала основная цена (PRICE), иначе первая найденная
+def _state_price(item):
+    for state in item.get("mainState") or []:
+        prices = ((state.get("atom") or {}).get("priceV2") or {}).get("price") or []
+        for price in prices:
+            if price.get("textStyle") == "PRICE":
+                return price.get("text")
+        if prices:
+            return prices[0].get("text")
+    return None
+
+# Картинка товара из блока состояния
+def _state_image(item):
+    for image in (item.get("tileImage") or {}).get("items") or []:
+        link = (image.get("image") or {}).get("link")
+        if link:
+            return link
+    return None
+
+# Извлечение товаров из встроенного JSON-состояния страницы (без построения DOM)
+@metrics.timed(page_parse_seconds, parser="state")
+def extract_items_from_state(html, limit=LIMIT):
+    results = []
+    for tag in STATE_TAG_PATTERN.finditer(html):
+        attr = STATE_ATTR_PATTERN.search(tag.group(0))
+        if not attr:
+            continue
+        raw = (attr.group(1) if attr.group(1) is not None else attr.group(2)).decode("utf-8")
+        try:
+            state = json.loads(html_lib.unescape(raw))
+        except ValueError:
+            continue
+        for item in state.get("items") or []:
+            link = (item.get("action") or {}).get("link")
+            if not link:
                 continue
-            price_tag = item.find("span", class_="tsHeadline500Medium")
-            price = price_tag.text.strip() if price_tag else "Цена не найдена"
-            img_tag = item.find("img", attrs={"loading": ("eager", "lazy")})
-            img_url = img_tag["src"] if img_tag and img_tag.has_attr("src") else "Картинка не найдена"
-            results.append((f"Ссылка: {full_url}\nЦена: {price}", img_url))
+            results.append(make_item(link, _state_price(item), _state_image(item)))
+            if len(results) >= limit:
+                return results
+    return results
+
+# Извлечение товаров из страницы, загруженной без браузера: из JSON-состояния, иначе из карточек
+def extract_items_from_response(html):
+    return extract_items_from_state(html) or extract_items(html)
+
+# Загрузка страницы обычным HTTP-запросом: быстро, но Ozon может отдать заглушку вместо выдачи.
+# Страница весит несколько мегабайт, поэтому разбирается в отдельном потоке, а не в цикле событий
+async def fetch_via_http(url):
+    try:
+        response = await ozon_http.get(url)
+        if response.status_code != 200:
+            logger.info(f"Страница {url} без браузера недоступна: HTTP {response.status_code}")
+            return []
+        return await asyncio.get_running_loop().run_in_executor(parse_executor, extract_items_from_response, response.content)
+    except Exception as e:
+        logger.info(f"Не удалось загрузить {url} без браузера: {e}")
+        return []
+
+# Статистика загрузок страницы. Обработчики заданий не получают отписок,
+# поэтому вытесняются страницы, которые дольше всего не загружались
+def page_stats(url):
+    stats = fetch_stats.get(url)
+    if stats is None:
+        stats = fetch_stats[url] = Counter()
+        while len(fetch_stats) > FETCH_STATS_SIZE:
+            fetch_stats.popitem(last=False)
+    fetch_stats.move_to_end(url)
+    return stats
+
+# Сводка по страницам, которые чаще всего не удается загрузить без браузера
+def fetch_stats_summary(limit=FETCH_STATS_REPLY_PAGES):
+    pages = sorted(fetch_stats.items(), key=lambda entry: entry[1]["browser"] + entry[1]["failed"], reverse=True)
+    lines = []
+    for url, stats in pages[:limit]:
+        if not stats["browser"] + stats["failed"]:
+            break
+        line = f"{url}: http {stats['http']}, браузер {stats['browser']}, не загружена {stats['failed']}"
+        if stats["browser_requests"]:
+            line += f", трафик браузера {stats['browser_bytes'] // 1024} КБ за {stats['browser_requests']} запросов"
+        lines.append(line)
+    return lines
+
+# Периодическая запись сводки по загрузкам в лог (у процессов ozon_worker.py нет /stats)
+async def log_fetch_stats():
+    while True:
+        await asyncio.sleep(FETCH_STATS_LOG_INTERVAL)
+        lines = fetch_stats_summary()
+        if lines:
+            logger.info("Страницы, которые загружаются браузером:\n" + "\n".join(lines))
+
+# Парсинг страницы: сначала без браузера, при неудаче - через Selenium
+@metrics.timed(page_fetch_seconds)
+async def parse_page(url):
+    stats = page_stats(url)
+    if HTTP_FETCH_ENABLED:
+        results = await fetch_via_http(url)
+        if results:
+            stats["http"] += 1
+            page_fetch_total.inc(tier="http")
+            return results
+    results = await fetch_via_browser(url)
+    tier = "browser" if results else "failed"
+    stats[tier] += 1
+    page_fetch_total.inc(tier=tier)
+    return results
+
+# Загрузка страницы через браузер из пула
+async def fetch_via_browser(url):
+    driver = await driver_pool.acquire()
+    broken = False
+
+    results = []
+    try:
+        results, traffic = await run_in_browser_thread(render_page, driver, url)
+        if traffic:
+            transferred, requests_made, blocked = traffic
+            page_transfer_bytes.observe(transferred)
+            page_requests.observe(requests_made)
+            page_blocked_requests_total.inc(blocked)
+            stats = page_stats(url)
+            stats["browser_bytes"] += transferred
+            stats["browser_requests"] += requests_made
+            logger.info(f"Страница {url}: {transferred // 1024} КБ, запросов {requests_made}, заблокировано {blocked}.")
+    except TimeoutException as e:
+        logger.error(f"Страница {url} не загрузилась за {PAGE_LOAD_TIMEOUT} с: {e}")
+    except WebDriverException as e:
+        broken = True
+        logger.error(f"Ошибка браузера при парсинге страницы {url}: {e}")
     except Exception as e:
         logger.error(f"Ошибка при парсинге страницы {url}: {e}")
     finally:
-        driver.quit()
+        await driver_pool.release(driver, broken=broken)
     return results
 
-# Отправка результатов пользователю
-async def send_results(user_id, url):
+# Получение выдачи страницы: в процессе бота или через очередь заданий
+async def fetch_listing(key):
+    if scrape_jobs is None:
+        return await parse_page(key)
+    job_id = await scrape_jobs.submit(key)
+    results = await scrape_jobs.wait_result(job_id, SCRAPE_JOB_TIMEOUT)
+    if results is None:
+        logger.error(f"Обработчики не вернули результат по URL {key} за {SCRAPE_JOB_TIMEOUT} с.")
+        return []
+    return results
+
+# Обработчик заданий: берет URL из своих разделов очереди, загружает страницу и возвращает товары
+async def run_scrape_worker(queue, worker_id):
+    async def send_heartbeats():
+        while True:
+            await queue.heartbeat(worker_id)
+            await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+    heartbeat_task = asyncio.create_task(send_heartbeats())
+    logger.info(f"Обработчик {worker_id} запущен.")
+    try:
+        while True:
+            job = await queue.take(worker_id, WORKER_HEARTBEAT_INTERVAL)
+            if job is None:
+                continue
+            job_id, url = job
+            try:
+                results = await parse_page(url)
+            except Exception as e:
+                logger.error(f"Обработчик {worker_id}: ошибка при загрузке {url}: {e}")
+                results = []
+            await queue.complete(job_id, results)
+    finally:
+        heartbeat_task.cancel()
+        await queue.unregister(worker_id)
+
+# Периодическая проверка обработчиков: задания упавших передаются остальным
+async def watch_scrape_workers(queue):
     while True:
-        results = await parse_page(url)
-        if not results:
-            logger.warning(f"Нет данных для отправки пользователю {user_id} по URL: {url}")
-        else:
-            for item_message, img_url in results:
-                await send_text_to_telegram(user_id, item_message, img_url)
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+        try:
+            await queue.reassign_dead()
+        except Exception as e:
+            logger.error(f"Ошибка при проверке обработчиков: {e}")
+
+# Отправка изменений всем подписчикам страницы: страница загружается один раз за опрос.
+# Новые подписчики получают текущую выдачу целиком, остальные - только новые товары
+# и изменения цены. Возвращает False, если данных получить не удалось (планировщик увеличит паузу).
+async def send_results(key):
+    results = await fetch_listing(key)
+    if not results:
+        logger.warning(f"Нет данных для отправки по URL: {key}")
+        return False
+    try:
+        price_history.record(results)
+    except Exception as e:
+        logger.error(f"Ошибка при записи истории цен по URL {key}: {e}")
+
+    fingerprint = listing_fingerprint(results)
+    changes = []
+    if fingerprint != snapshots.fingerprint(key):
+        changes = snapshots.update(key, results, fingerprint)
+    pending = store.pending_users(key)
+    if not changes and not pending:
+        logger.info(f"Выдача по URL {key} не изменилась.")
+        return True
+
+    for user_id, url in list(subscribers.get(key, {}).items()):
+        # Если вся выдача уже ждет отправки, новому подписчику достаточно изменений
+        first = user_id in pending and (user_id, url) not in first_deliveries
+        items = results if first else changes
+        if items:
+            if first:
+                first_deliveries.add((user_id, url))
+            delivery.enqueue(user_id, items, functools.partial(on_delivered, user_id, url))
+    return True
+
+# Отметка об отправке: время последней отправки обновляется только после того, как Telegram принял сообщения,
+# иначе новый подписчик при следующем опросе снова получит всю выдачу
+def on_delivered(user_id, url, delivered):
+    first_deliveries.discard((user_id, url))
+    if delivered:
         update_last_sent_time(user_id, url)
-        await asyncio.sleep(POLL_INTERVAL_SECONDS)  # Ожидание
 
-# Функция для обновления времени последней отправки в файле
+# Планировщик опросов: одна очередь с приоритетом по времени следующего опроса
+# и общее ограничение на количество одновременных загрузок.
+class PollScheduler:
+    def __init__(self, poll, max_concurrent):
+        self.poll = poll  # Корутина poll(key), возвращает True при успешном опросе
+        self._heap = []  # (время опроса, порядковый номер, URL)
+        self._entries = {}  # URL -> порядковый номер актуальной записи в очереди
+        self._intervals = {}  # URL -> интервал опроса
+        self._failures = {}  # URL -> количество неудачных опросов подряд
+        self._seq = itertools.count()
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._wakeup = asyncio.Event()
+        self._jobs = set()
+
+    def __contains__(self, key):
+        return key in self._intervals
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def add(self, key, interval=None, delay=0):
+        self._intervals[key] = interval or POLL_INTERVALS.get(key, POLL_INTERVAL_SECONDS)
+        self._push(key, time.monotonic() + delay)
+
+    # Записи в очереди не удаляются, а пропускаются при извлечении
+    def remove(self, key):
+        self._intervals.pop(key, None)
+        self._failures.pop(key, None)
+        self._entries.pop(key, None)
+
+    def _push(self, key, due):
+        seq = next(self._seq)
+        self._entries[key] = seq
+        heapq.heappush(self._heap, (due, seq, key))
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            due, seq, key = self._heap[0]
+            if self._entries.get(key) != seq:
+                heapq.heappop(self._heap)  # Устаревшая запись
+                continue
+
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            del self._entries[key]
+            await self._slots.acquire()
+            if key not in self._intervals:  # Страницу убрали, пока ждали свободного слота
+                self._slots.release()
+                continue
+            job = asyncio.create_task(self._run_job(key))
+            self._jobs.add(job)
+            job.add_done_callback(self._jobs.discard)
+
+    async def _run_job(self, key):
+        try:
+            ok = await self.poll(key)
+        except Exception as e:
+            logger.error(f"Ошибка при опросе {key}: {e}")
+            ok = False
+        finally:
+            self._slots.release()
+
+        interval = self._intervals.get(key)
+        if interval is None or key in self._entries:
+            return
+        if ok:
+            self._failures.pop(key, None)
+            delay = interval
+        else:
+            failures = self._failures.get(key, 0) + 1
+            self._failures[key] = failures
+            delay = min(interval * 2 ** failures, MAX_BACKOFF_SECONDS)
+            logger.warning(f"Опрос {key} не удался {failures} раз(а) подряд, следующий через {int(delay)} с.")
+        self._push(key, time.monotonic() + delay + random.uniform(0, delay * POLL_JITTER))
+
+    async def close(self):
+        for job in list(self._jobs):
+            job.cancel()
+        await asyncio.gather(*self._jobs, return_exceptions=True)
+
+# Функция для обновления времени последней отправки
 def update_last_sent_time(user_id, url):
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    try:
-        with open(URLS_FILE, "r") as f:
-            lines = f.readlines()
-
-        with open(URLS_FILE, "w") as f:
-            for line in lines:
-                line = line.strip()
-                if not line or "|" not in line:
-                    continue
-                try:
-                    stored_user_id, stored_url, _ = line.split("|", 2)
-                    if stored_user_id == user_id and stored_url == url:
-                        f.write(f"{user_id}|{url}|{current_time}\n")
-                    else:
-                        f.write(line + "\n")
-                except ValueError:
-                    logger.warning(f"Некорректная строка в файле: {line}")
-    except FileNotFoundError:
-        logger.error("Файл urls.txt не найден.")
+    store.touch(user_id, url, current_time)
+
+# Ограничение частоты отправки: общее для бота и отдельное для каждого чата.
+# Каждый вызов резервирует ближайший свободный момент и ждет его.
+class RateLimiter:
+    def __init__(self, global_rate, chat_interval):
+        self.global_interval = 1 / global_rate
+        self.chat_interval = chat_interval
+        self._global_next = 0.0
+        self._chat_next = {}
+
+    async def wait(self, chat_id, cost=1):
+        now = time.monotonic()
+        chat_slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = chat_slot + self.chat_interval * cost
+        slot = max(chat_slot, self._global_next)
+        self._global_next = slot + self.global_interval * cost
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+# Очередь исходящих сообщений. Обработчики только ставят результаты в очередь,
+# а отправкой занимаются несколько фоновых задач через общий пул HTTP-соединений.
+class TelegramDelivery:
+    def __init__(self, token, workers):
+        self.token = token
+        self.workers = workers
+        self.queue = asyncio.Queue()
+        self.limiter = RateLimiter(GLOBAL_SEND_RATE, CHAT_SEND_INTERVAL)
+        self.client = None
+        self._tasks = []
+
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            base_url=f"{TELEGRAM_API_URL}/bot{self.token}/",
+            timeout=30,
+            limits=httpx.Limits(max_connections=DELIVERY_CONNECTIONS, max_keepalive_connections=DELIVERY_CONNECTIONS),
+        )
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    # Постановка товаров в очередь на отправку, не блокирует вызывающего.
+    # on_done(delivered) вызывается после отправки: delivered - все ли сообщения приняты Telegram
+    def enqueue(self, chat_id, items, on_done=None):
+        self.queue.put_nowait((chat_id, items, on_done))
+
+    async def _worker(self):
+        while True:
+            chat_id, items, on_done = await self.queue.get()
+            delivered = False
+            try:
+                delivered = await self.deliver(chat_id, items)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке результатов в чат ID {chat_id}: {e}")
+            finally:
+                self.queue.task_done()
+                if on_done is not None:
+                    on_done(delivered)
+
+    # Результаты одного опроса уходят одним альбомом (sendMediaGroup), одиночный товар - через sendPhoto.
+    # Возвращает True, если Telegram принял все сообщения
+    async def deliver(self, chat_id, items):
+        delivered = True
+        photos = []
+        for item in items:
+            if item["img"]:
+                photos.append(item)
+            else:
+                logger.warning(f"Пустая ссылка на изображение для чата ID {chat_id}")
+        for start in range(0, len(photos), ALBUM_SIZE):
+            chunk = photos[start:start + ALBUM_SIZE]
+            if len(chunk) == 1:
+                sent = await send_text_to_telegram(chat_id, format_item(chunk[0]), chunk[0]["img"])
+            else:
+                sent = await send_album(chat_id, chunk)
+            if not sent:
+                delivered = False
+        return delivered
+
+    # Вызов метода Bot API с соблюдением лимитов и повтором после 429 (retry_after)
+    async def call(self, method, payload, cost=1):
+        chat_id = payload.get("chat_id")
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            await self.limiter.wait(chat_id, cost)
+            try:
+                response = await self.client.post(method, json=payload)
+            except httpx.HTTPError as e:
+                logger.warning(f"Сетевая ошибка при вызове {method} (попытка {attempt}): {e}")
+                await asyncio.sleep(2 ** attempt)
+                continue
+            if response.status_code == 200:
+                return response.json().get("result")
+            if response.status_code == 429:
+                retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+                logger.warning(f"Превышен лимит Telegram для чата ID {chat_id}, ждем {retry_after} с.")
+                await asyncio.sleep(retry_after)
+                continue
+            logger.error(f"Ошибка при отправке: {response.text}")
+            if response.status_code == 400 and WRONG_FILE_ID_PATTERN.search(response.text):
+                raise WrongFileIdError(response.text)
+            return None
+        logger.error(f"Не удалось вызвать {method} для чата ID {chat_id} за {MAX_SEND_ATTEMPTS} попыток.")
+        return None
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.client:
+            await self.client.aclose()
+
+# Telegram не принял file_id (или ссылку) из запроса
+class WrongFileIdError(Exception):
+    pass
+
+# Кэш URL картинки -> file_id, который Telegram вернул при первой загрузке.
+# Повторные отправки используют file_id, и Telegram не скачивает картинку заново.
+# Вытесняются картинки, которые дольше всего не отправлялись.
+class FileIdCache:
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._unsaved = 0
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self._entries = OrderedDict(json.load(f))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            logger.info(f"Загружен кэш картинок: {len(self._entries)} записей.")
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.error(f"Файл {self.path} поврежден, кэш картинок начат заново: {e}")
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(list(self._entries.items()), f)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, img_url):
+        file_id = self._entries.get(img_url)
+        if file_id is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(img_url)
+        return file_id
+
+    # Сохраняет новый или изменившийся file_id; на диск пишется раз в FILE_ID_SAVE_EVERY таких записей
+    def put(self, img_url, file_id):
+        if self._entries.get(img_url) == file_id:
+            return
+        self._entries[img_url] = file_id
+        self._entries.move_to_end(img_url)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._unsaved += 1
+        if self._unsaved >= FILE_ID_SAVE_EVERY:
+            self.save()
+
+    def discard(self, img_url):
+        self._entries.pop(img_url, None)
+
+# file_id самого большого размера фото из ответа Telegram
+def photo_file_id(message):
+    photos = (message or {}).get("photo") or []
+    return photos[-1]["file_id"] if photos else None
 
 # Отправка сообщения в Telegram
+@metrics.timed(telegram_send_seconds, method="sendPhoto")
 async def send_text_to_telegram(chat_id, message, img_url=None):
-    send_photo_url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendPhoto"
+    if not img_url:
+        logger.warning(f"Пустая ссылка на изображение для чата ID {chat_id}")
+        return False
     try:
-        if img_url:
-            photo_data = {"chat_id": chat_id, "photo": img_url, "caption": message}
-            response_photo = requests.post(send_photo_url, data=photo_data)
-            if response_photo.status_code == 200:
-                logger.info(f"Успешно отправлено в чат ID {chat_id}")
-            else:
-                logger.error(f"Ошибка при отправке: {response_photo.text}")
-        else:
-            logger.warning(f"Пустая ссылка на изображение для чата ID {chat_id}")
+        file_id = file_ids.get(img_url)
+        try:
+            result = await delivery.call("sendPhoto", {"chat_id": chat_id, "photo": file_id or img_url, "caption": message})
+        except WrongFileIdError:
+            if not file_id:
+                raise
+            # file_id устарел: забываем его и отправляем по ссылке
+            file_ids.discard(img_url)
+            file_id = None
+            result = await delivery.call("sendPhoto", {"chat_id": chat_id, "photo": img_url, "caption": message})
+        if result:
+            if not file_id and photo_file_id(result):
+                file_ids.put(img_url, photo_file_id(result))
+            logger.info(f"Успешно отправлено в чат ID {chat_id}")
+            return True
     except Exception as e:
         logger.error(f"Ошибка при отправке сообщения в Telegram: {e}")
+    return False
+
+# Отправка нескольких товаров одним альбомом
+@metrics.timed(telegram_send_seconds, method="sendMediaGroup")
+async def send_album(chat_id, items):
+    try:
+        cached = [file_ids.get(item["img"]) for item in items]
+        media = [
+            {"type": "photo", "media": file_id or item["img"], "caption": format_item(item)}
+            for item, file_id in zip(items, cached)
+        ]
+        try:
+            result = await delivery.call("sendMediaGroup", {"chat_id": chat_id, "media": media}, cost=len(media))
+        except WrongFileIdError:
+            if not any(cached):
+                raise
+            # Какой из file_id устарел, Telegram не сообщает: забываем все из альбома и отправляем по ссылкам
+            for item, file_id in zip(items, cached):
+                if file_id:
+                    file_ids.discard(item["img"])
+            cached = [None] * len(items)
+            media = [{"type": "photo", "media": item["img"], "caption": format_item(item)} for item in items]
+            result = await delivery.call("sendMediaGroup", {"chat_id": chat_id, "media": media}, cost=len(media))
+        if result:
+            # Новые file_id запоминаются только для картинок, отправленных по ссылке
+            for item, file_id, sent in zip(items, cached, result):
+                if not file_id and photo_file_id(sent):
+                    file_ids.put(item["img"], photo_file_id(sent))
+            logger.info(f"Альбом из {len(media)} фото успешно отправлен в чат ID {chat_id}")
+            return True
+    except Exception as e:
+        logger.error(f"Ошибка при отправке альбома в Telegram: {e}")
+    return False
 
 # Обработчик команды /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -190,25 +1340,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Проверка URL Ozon
     if OZON_URL_PATTERN.match(url):
         # Проверка, отслеживается ли уже URL
-        if user_id in active_tasks:
-            urls_tracked = [tracked_url for _, tracked_url in active_tasks[user_id]]
-            if url in urls_tracked:
-                await update.message.reply_text("Этот URL уже отслеживается.")
-                return
-
-        # Сохраняем URL, если он еще не отслеживается
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(URLS_FILE, "a") as f:
-            f.write(f"{user_id}|{url}|{current_time}\n")
-            logger.info(f"URL {url} добавлен для пользователя {user_id} с временем последней отправки {current_time}.")
-
-        # Инициализация задач, если их нет
-        if user_id not in active_tasks:
-            active_tasks[user_id] = []
-
-        # Запускаем задачу для нового URL
-        task = asyncio.create_task(send_results(user_id, url))
-        active_tasks[user_id].append((task, url))
+        if is_subscribed(user_id, url):
+            await update.message.reply_text("Этот URL уже отслеживается.")
+            return
+
+        # Сохраняем URL, если он еще не отслеживается.
+        # Время последней отправки пустое: при ближайшем опросе пользователь получит всю выдачу.
+        store.add(user_id, url)
+        logger.info(f"URL {url} добавлен для пользователя {user_id}.")
+
+        # Подписываем пользователя; опрос страницы запускается, если его еще нет
+        subscribe(user_id, url)
         await update.message.reply_text("Я начал отслеживать эту страницу. Буду отправлять обновления!")
     else:
         await update.message.reply_text("Пожалуйста, отправьте корректный URL страницы Ozon (category, search, collection или brand).")
@@ -218,18 +1360,10 @@ async def list_urls(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
 
     # Проверяем, есть ли отслеживаемые URL для пользователя
-    urls = []
-    lines = read_file_lines(URLS_FILE)
-    for line in lines:
-        line = line.strip()
-        if not line or "|" not in line:
-            continue
-        try:
-            stored_user_id, stored_url, timestamp = line.split("|", 2)
-            if stored_user_id == user_id:
-                urls.append(f"URL: {stored_url}\nПоследняя отправка: {timestamp}")
-        except ValueError:
-            logger.warning(f"Некорректная строка: {line}")
+    urls = [
+        f"URL: {stored_url}\nПоследняя отправка: {timestamp or '—'}"
+        for stored_url, timestamp in store.list_for_user(user_id)
+    ]
 
     if urls:
         # Формируем и отправляем список
@@ -249,6 +1383,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/list - Показать список ваших отслеживаемых URL.\n"
         "/tasks - Показать список активных отслеживаемых задач.\n"
         "/remove - Удалить url из отслеживания.\n"
+        "/history - История цены товара: /history <ссылка на товар> [дней].\n"
         "/help - Показать это сообщение.\n\n"
         "Просто отправьте ссылку на страницу Ozon, чтобы начать её отслеживать!"
     )
@@ -259,16 +1394,10 @@ async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.from_user.id)
 
     if user_id in active_tasks:
-        for task, _ in active_tasks[user_id]:
-            task.cancel()  # Останавливаем задачу
-        del active_tasks[user_id]
-
-        # Чтение, фильтрация и запись строк в файл
-        with open(URLS_FILE, 'r') as file:
-            lines = file.readlines()
+        for url in list(active_tasks[user_id]):
+            unsubscribe(user_id, url)  # Останавливаем опрос, если больше никто не подписан
 
-        with open(URLS_FILE, 'w') as file:
-            file.writelines(line for line in lines if not line.startswith(f"{user_id}|"))
+        store.remove_user(user_id)
 
         logger.info(f"URL для пользователя {user_id} удален.")
         await update.message.reply_text("Я больше не буду отслеживать ваш URL.")
@@ -285,7 +1414,7 @@ async def tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_tasks:
         total_tasks = len(user_tasks)
         message_lines = [f"Активные задачи для пользователя {user_id} (всего: {total_tasks}):"]
-        for index, (task, url) in enumerate(user_tasks, start=1):
+        for index, url in enumerate(user_tasks, start=1):
             message_lines.append(f"{index}. Отслеживание URL: {url}")
         message = "\n".join(message_lines)
     else:
@@ -301,36 +1430,147 @@ async def remove_url_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     url_to_remove = context.args[0].strip()
-    removed = False
 
-    # Удаление URL из файла
-    try:
-        with open(URLS_FILE, "r") as f:
-            lines = f.readlines()
-        with open(URLS_FILE, "w") as f:
-            for line in lines:
-                stored_user_id, stored_url, _ = line.strip().split("|", 2)
-                if stored_user_id == user_id and stored_url == url_to_remove:
-                    removed = True
-                else:
-                    f.write(line)
-        if removed:
-            # Остановка задачи отслеживания
-            if user_id in active_tasks:
-                for task, url in active_tasks[user_id]:
-                    if url == url_to_remove:
-                        task.cancel()
-                        active_tasks[user_id].remove((task, url))
-            await update.message.reply_text(f"URL {url_to_remove} удален из отслеживания.")
+    # Удаление URL из базы
+    removed = store.remove(user_id, url_to_remove)
+    if removed:
+        # Остановка задачи отслеживания
+        for url in removed:
+            unsubscribe(user_id, url)
+        await update.message.reply_text(f"URL {url_to_remove} удален из отслеживания.")
+    else:
+        await update.message.reply_text("Указанный URL не найден в вашем списке отслеживания.")
+
+# Обработчик команды /history: сводка и последние точки истории цены товара
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.message.from_user.id)
+    if user_id not in allowed_ids:
+        await update.message.reply_text("Ваш ID не в списке разрешенных. Доступ закрыт.")
+        return
+    if not context.args:
+        await update.message.reply_text("Укажите ссылку на товар. Пример: /history https://www.ozon.ru/product/... 30")
+        return
+
+    days = None
+    if len(context.args) > 1:
+        days = int(context.args[1]) if context.args[1].isdigit() else 0
+        if days <= 0:
+            await update.message.reply_text("Количество дней - целое число больше нуля. Пример: /history https://www.ozon.ru/product/... 30")
+            return
+
+    product_url = context.args[0].strip()
+    times, prices = price_history.read(product_url)
+    if days:
+        start = bisect.bisect_left(times, time.time() - days * 86400)
+        times, prices = times[start:], prices[start:]
+    if not times:
+        await update.message.reply_text("Истории цен для этого товара пока нет.")
+        return
+
+    def point_text(index):
+        return f"{datetime.fromtimestamp(times[index]):%d.%m.%Y %H:%M} - {prices[index]:.0f} ₽"
+
+    low = min(range(len(prices)), key=prices.__getitem__)
+    high = max(range(len(prices)), key=prices.__getitem__)
+    lines = [
+        f"История цены с {datetime.fromtimestamp(times[0]):%d.%m.%Y} (точек: {len(times)})",
+        f"Минимум: {point_text(low)}",
+        f"Максимум: {point_text(high)}",
+        f"Последняя: {point_text(len(times) - 1)}",
+        "",
+        "Последние изменения:",
+    ]
+    lines += [point_text(index) for index in range(max(0, len(times) - HISTORY_REPLY_POINTS), len(times))]
+    await update.message.reply_text("\n".join(lines))
+
+# Обработчик команды /stats (только для администраторов)
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.message.from_user.id)
+    if user_id not in admin_ids:
+        await update.message.reply_text("Команда доступна только администраторам.")
+        return
+    text = metrics.summary()
+    pages = fetch_stats_summary()
+    if pages:
+        text += "\n\nСтраницы, которые загружаются браузером:\n" + "\n".join(pages)
+    elif SCRAPE_BACKEND == "redis":
+        text += "\n\nСтатистика загрузок по страницам - в логах ozon_worker.py."
+    await update.message.reply_text(text)
+
+# Запуск всего, что нужно для загрузки страниц: потоков и пула браузеров, HTTP-клиента
+async def start_scraper():
+    global browser_executor, parse_executor, driver_pool, ozon_http
+    browser_executor = ThreadPoolExecutor(max_workers=max(1, DRIVER_POOL_SIZE), thread_name_prefix="browser")
+    parse_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SCRAPES, thread_name_prefix="parse")
+    driver_pool = DriverPool(DRIVER_POOL_SIZE, DRIVER_MAX_PAGES)
+    await driver_pool.start()
+    ozon_http = httpx.AsyncClient(
+        headers={"User-Agent": USER_AGENT, "Accept-Language": "ru-RU,ru;q=0.9"},
+        timeout=HTTP_FETCH_TIMEOUT,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=MAX_CONCURRENT_SCRAPES, max_keepalive_connections=MAX_CONCURRENT_SCRAPES),
+    )
+
+async def stop_scraper():
+    await driver_pool.close()
+    await ozon_http.aclose()
+    browser_executor.shutdown(wait=False)
+    parse_executor.shutdown(wait=False)
+
+# Запуск хранилищ, загрузки страниц, очереди отправки и планировщика опросов
+async def start_services():
+    global store, snapshots, price_history, file_ids, scheduler, scheduler_task, delivery, scrape_jobs, background_tasks
+    store = SubscriptionStore(DB_FILE)
+    store.migrate_from_file(URLS_FILE)
+    snapshots = SnapshotStore(DB_FILE)
+    price_history = PriceHistory(HISTORY_DIR)
+    file_ids = FileIdCache(FILE_ID_CACHE_FILE, FILE_ID_CACHE_SIZE)
+    file_ids.load()
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    delivery = TelegramDelivery(TELEGRAM_TOKEN, DELIVERY_WORKERS)
+    await delivery.start()
+
+    background_tasks = [asyncio.create_task(run_history_compaction())]
+    max_concurrent = MAX_CONCURRENT_SCRAPES
+    if SCRAPE_BACKEND == "inline":
+        await start_scraper()
+    else:
+        if SCRAPE_BACKEND == "redis":
+            scrape_jobs = scrape_queue.RedisScrapeQueue(REDIS_URL)
         else:
-            await update.message.reply_text("Указанный URL не найден в вашем списке отслеживания.")
-    except FileNotFoundError:
-        logger.error("Файл urls.txt не найден.")
-        await update.message.reply_text("Ошибка: файл с URL не найден.")
+            scrape_jobs = scrape_queue.LocalScrapeQueue()
+            await start_scraper()
+            background_tasks += [
+                asyncio.create_task(run_scrape_worker(scrape_jobs, f"local-{index}"))
+                for index in range(LOCAL_SCRAPE_WORKERS)
+            ]
+        background_tasks.append(asyncio.create_task(watch_scrape_workers(scrape_jobs)))
+        max_concurrent = REMOTE_MAX_IN_FLIGHT
+
+    scheduler = PollScheduler(send_results, max_concurrent)
+    scheduler_task = asyncio.create_task(scheduler.run())
+
+# Остановка всего, что запущено в start_services
+async def stop_services():
+    scheduler_task.cancel()
+    await scheduler.close()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if scrape_jobs is not None:
+        await scrape_jobs.close()
+    if SCRAPE_BACKEND != "redis":
+        await stop_scraper()
+    await delivery.close()
+    file_ids.save()
+    snapshots.close()
+    store.close()
 
 # Настройка и запуск бота
 def main():
     load_allowed_ids()
+    load_admin_ids()
     application = ApplicationBuilder().token(TELEGRAM_TOKEN).read_timeout(30).write_timeout(30).connect_timeout(30).build()
 
     application.add_handler(CommandHandler("start", start))
@@ -339,9 +1579,12 @@ def main():
     application.add_handler(CommandHandler("tasks", tasks))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("remove", remove_url_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("history", history_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     async def async_main():
+        await start_services()
         await restore_tasks()
         logger.info("Бот запущен и восстановил задачи.")
         await application.initialize()
@@ -353,6 +1596,7 @@ def main():
             await application.updater.stop()
             await application.stop()
             await application.shutdown()
+            await stop_services()
 
     try:
         asyncio.run(async_main())
@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+import logging
+import socket
+import uuid
+
+import metrics
+import ozon_observe_tg as ozon
+import scrape_queue
+
+# Отдельный процесс-обработчик заданий на загрузку страниц Ozon.
+# Бот (SCRAPE_BACKEND = "redis") только ставит задания в очередь и рассылает изменения,
+# а страницы загружают такие процессы - их можно запускать на нескольких машинах:
+#   python ozon_worker.py --redis-url redis://queue-host:6379/0 --concurrency 2
+
+logger = logging.getLogger(__name__)
+
+async def run(args):
+    queue = scrape_queue.RedisScrapeQueue(args.redis_url)
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+    ozon.DRIVER_POOL_SIZE = args.concurrency
+    await ozon.start_scraper()
+    workers = [
+        asyncio.create_task(ozon.run_scrape_worker(queue, f"{args.name}-{index}"))
+        for index in range(args.concurrency)
+    ]
+    logger.info(f"Запущено обработчиков: {len(workers)}")
+    workers.append(asyncio.create_task(ozon.log_fetch_stats()))
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await ozon.stop_scraper()
+        await queue.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Обработчик заданий на загрузку страниц Ozon")
+    parser.add_argument("--redis-url", default=ozon.REDIS_URL, help="Адрес Redis с очередью заданий")
+    parser.add_argument("--concurrency", type=int, default=ozon.DRIVER_POOL_SIZE, help="Одновременных загрузок (и браузеров)")
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}", help="Имя обработчика")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Порт для метрик Prometheus")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        logger.info("Обработчик остановлен.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+import zlib
+from collections import deque
+
+# Очередь заданий на загрузку страниц Ozon между ботом (координатором) и процессами-обработчиками.
+# Задания раскладываются по разделам по хэшу URL; каждый раздел обслуживает один живой обработчик.
+# Если обработчик перестает присылать heartbeat, его разделы достаются остальным,
+# а взятые им задания возвращаются в очередь.
+#
+# LocalScrapeQueue - в памяти процесса (для проверки и запуска без внешних сервисов),
+# RedisScrapeQueue - общая очередь для обработчиков на разных машинах (нужен пакет redis).
+
+logger = logging.getLogger(__name__)
+
+PARTITIONS = 16  # Количество разделов
+WORKER_TIMEOUT = 30  # Через сколько секунд без heartbeat обработчик считается упавшим
+RESULT_TTL = 600  # Сколько секунд хранится невостребованный результат (Redis)
+TAKE_POLL_INTERVAL = 0.5  # Пауза между проверками пустых разделов (Redis)
+
+# Раздел для URL
+def partition_for(url, partitions=PARTITIONS):
+    return zlib.crc32(url.encode()) % partitions
+
+# Разделы, которые обслуживает обработчик при данном составе живых обработчиков
+def owned_partitions(worker_id, live_workers, partitions=PARTITIONS):
+    workers = sorted(live_workers)
+    if worker_id not in workers:
+        return []
+    index = workers.index(worker_id)
+    return [partition for partition in range(partitions) if partition % len(workers) == index]
+
+class LocalScrapeQueue:
+    def __init__(self, partitions=PARTITIONS, worker_timeout=WORKER_TIMEOUT):
+        self.partitions = partitions
+        self.worker_timeout = worker_timeout
+        self._pending = [deque() for _ in range(partitions)]
+        self._inflight = {}  # ID задания -> (URL, обработчик)
+        self._results = {}  # ID задания -> Future с результатом
+        self._workers = {}  # Обработчик -> время последнего heartbeat
+        self._changed = asyncio.Condition()
+
+    def _live_workers(self):
+        now = time.monotonic()
+        return [worker for worker, seen in self._workers.items() if now - seen <= self.worker_timeout]
+
+    async def submit(self, url):
+        job_id = uuid.uuid4().hex
+        self._results[job_id] = asyncio.get_running_loop().create_future()
+        async with self._changed:
+            self._pending[partition_for(url, self.partitions)].append((job_id, url))
+            self._changed.notify_all()
+        return job_id
+
+    # Результат задания или None, если он не получен за timeout секунд
+    async def wait_result(self, job_id, timeout):
+        future = self._results[job_id]
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._results.pop(job_id, None)
+
+    async def heartbeat(self, worker_id):
+        joined = worker_id not in self._workers
+        self._workers[worker_id] = time.monotonic()
+        if joined:
+            async with self._changed:
+                self._changed.notify_all()
+
+    # Следующее задание из разделов обработчика: (ID задания, URL) или None по истечении timeout
+    async def take(self, worker_id, timeout):
+        deadline = time.monotonic() + timeout
+        async with self._changed:
+            while True:
+                for partition in owned_partitions(worker_id, self._live_workers(), self.partitions):
+                    if self._pending[partition]:
+                        job_id, url = self._pending[partition].popleft()
+                        self._inflight[job_id] = (url, worker_id)
+                        return job_id, url
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return None
+
+    async def complete(self, job_id, results):
+        self._inflight.pop(job_id, None)
+        future = self._results.get(job_id)
+        if future and not future.done():
+            future.set_result(results)
+
+    # Удаление обработчика: его задания возвращаются в начало своих разделов
+    async def unregister(self, worker_id):
+        async with self._changed:
+            self._workers.pop(worker_id, None)
+            for job_id, (url, owner) in list(self._inflight.items()):
+                if owner == worker_id:
+                    del self._inflight[job_id]
+                    self._pending[partition_for(url, self.partitions)].appendleft((job_id, url))
+            self._changed.notify_all()
+
+    # Поиск упавших обработчиков и перераспределение их заданий
+    async def reassign_dead(self):
+        now = time.monotonic()
+        dead = [worker for worker, seen in self._workers.items() if now - seen > self.worker_timeout]
+        for worker_id in dead:
+            logger.warning(f"Обработчик {worker_id} не отвечает, его задания переданы другим.")
+            await self.unregister(worker_id)
+        return dead
+
+    async def close(self):
+        pass
+
+class RedisScrapeQueue:
+    def __init__(self, url, partitions=PARTITIONS, worker_timeout=WORKER_TIMEOUT, prefix="ozon:scrape"):
+        import redis.asyncio as redis  # Необязательная зависимость, нужна только этому варианту очереди
+
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.partitions = partitions
+        self.worker_timeout = worker_timeout
+        self.prefix = prefix
+        self._taken = {}  # ID задания -> исходная запись (для удаления из списка "в работе")
+
+    def _partition_key(self, partition):
+        return f"{self.prefix}:partition:{partition}"
+
+    def _processing_key(self, worker_id):
+        return f"{self.prefix}:processing:{worker_id}"
+
+    def _result_key(self, job_id):
+        return f"{self.prefix}:result:{job_id}"
+
+    @property
+    def _workers_key(self):
+        return f"{self.prefix}:workers"
+
+    async def _live_workers(self):
+        now = time.time()
+        workers = await self.redis.hgetall(self._workers_key)
+        return [worker for worker, seen in workers.items() if now - float(seen) <= self.worker_timeout]
+
+    async def submit(self, url):
+        job_id = uuid.uuid4().hex
+        raw = json.dumps({"id": job_id, "url": url})
+        await self.redis.lpush(self._partition_key(partition_for(url, self.partitions)), raw)
+        return job_id
+
+    async def wait_result(self, job_id, timeout):
+        item = await self.redis.blpop([self._result_key(job_id)], timeout=max(1, int(timeout)))
+        if item is None:
+            return None
+        return json.loads(item[1])
+
+    async def heartbeat(self, worker_id):
+        await self.redis.hset(self._workers_key, worker_id, time.time())
+
+    # Задание атомарно переносится в список "в работе" обработчика (LMOVE),
+    # поэтому при падении обработчика оно не теряется
+    async def take(self, worker_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            for partition in owned_partitions(worker_id, await self._live_workers(), self.partitions):
+                raw = await self.redis.lmove(
+                    self._partition_key(partition), self._processing_key(worker_id), "RIGHT", "LEFT"
+                )
+                if raw:
+                    job = json.loads(raw)
+                    self._taken[job["id"]] = (worker_id, raw)
+                    return job["id"], job["url"]
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(TAKE_POLL_INTERVAL)
+
+    async def complete(self, job_id, results):
+        result_key = self._result_key(job_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(result_key, json.dumps(results))
+            pipe.expire(result_key, RESULT_TTL)
+            taken = self._taken.pop(job_id, None)
+            if taken:
+                worker_id, raw = taken
+                pipe.lrem(self._processing_key(worker_id), 1, raw)
+            await pipe.execute()
+
+    async def unregister(self, worker_id):
+        processing_key = self._processing_key(worker_id)
+        while True:
+            raw = await self.redis.rpop(processing_key)
+            if raw is None:
+                break
+            url = json.loads(raw)["url"]
+            # В правый конец: задание будет взято следующим
+            await self.redis.rpush(self._partition_key(partition_for(url, self.partitions)), raw)
+        await self.redis.hdel(self._workers_key, worker_id)
+
+    async def reassign_dead(self):
+        now = time.time()
+        workers = await self.redis.hgetall(self._workers_key)
+        dead = [worker for worker, seen in workers.items() if now - float(seen) > self.worker_timeout]
+        for worker_id in dead:
+            logger.warning(f"Обработчик {worker_id} не отвечает, его задания переданы другим.")
+            await self.unregister(worker_id)
+        return dead
+
+    async def close(self):
+        await self.redis.aclose()
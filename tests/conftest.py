@@ -0,0 +1,20 @@
+import gzip
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+# Чтение сохраненной страницы из tests/pages (большие страницы хранятся сжатыми)
+@pytest.fixture
+def read_page():
+    def read(name):
+        path = os.path.join(PAGES_DIR, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            return f.read()
+    return read
@@ -0,0 +1,43 @@
+import tracemalloc
+
+import pytest
+
+from ozon_observe_tg import LIMIT, extract_items, extract_items_bs4
+
+pytest.importorskip("pytest_benchmark")
+
+# Сравнение скорости и пикового потребления памяти при разборе сохраненных страниц Ozon (pytest-benchmark):
+#   python -m pytest tests/test_bench_extract.py --benchmark-group-by=group
+# Пиковая память одного разбора попадает в extra_info отчета (--benchmark-json).
+
+EXTRACTORS = {
+    "lxml": extract_items,
+    "bs4": extract_items_bs4,
+}
+PAGES = ["category.html", "search.html", "brand.html", "category_full.html.gz"]
+
+# Пиковая память одного разбора, КБ
+def peak_kb(extractor, html, limit):
+    tracemalloc.start()
+    try:
+        extractor(html, limit)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+@pytest.mark.parametrize("extractor", list(EXTRACTORS))
+@pytest.mark.parametrize("name", PAGES)
+def test_extract_benchmark(benchmark, read_page, name, extractor):
+    html = read_page(name)
+    benchmark.group = name
+    benchmark.extra_info["size_kb"] = round(len(html) / 1024, 1)
+    benchmark.extra_info["peak_kb"] = peak_kb(EXTRACTORS[extractor], html, LIMIT)
+    items = benchmark.pedantic(EXTRACTORS[extractor], args=(html, LIMIT), rounds=3, iterations=1)
+    assert items
+
+# На полной странице потоковый разбор останавливается после первых карточек
+# и не строит дерево всей страницы: памяти нужно во много раз меньше
+def test_full_page_memory(read_page):
+    html = read_page("category_full.html.gz")
+    assert peak_kb(extract_items, html, LIMIT) * 10 < peak_kb(extract_items_bs4, html, LIMIT)
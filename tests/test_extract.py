@@ -0,0 +1,34 @@
+import pytest
+
+import ozon_observe_tg
+from ozon_observe_tg import extract_items, extract_items_bs4
+
+# Сохраненные страницы Ozon: сокращенные категория, поиск и бренд и полная страница категории
+# (несколько мегабайт скриптов и состояний виджетов вокруг выдачи).
+# Среди карточек есть рекламные без ссылки, без цены, без картинки и с картинкой без src.
+PAGES = ["category.html", "search.html", "brand.html", "category_full.html.gz"]
+
+# Потоковый разбор lxml и разбор BeautifulSoup должны давать одни и те же товары
+@pytest.mark.parametrize("limit", [3, 10, 100])
+@pytest.mark.parametrize("name", PAGES)
+def test_extractors_agree(read_page, name, limit):
+    html = read_page(name)
+    items = extract_items(html, limit)
+    assert items
+    assert items == extract_items_bs4(html, limit)
+
+# Результат не зависит от того, на какие порции разрезана страница
+@pytest.mark.parametrize("chunk_size", [1024, 4096])
+@pytest.mark.parametrize("name", PAGES)
+def test_extract_items_chunk_boundaries(read_page, name, chunk_size, monkeypatch):
+    html = read_page(name)
+    expected = extract_items_bs4(html, 100)
+    monkeypatch.setattr(ozon_observe_tg, "PARSE_CHUNK_SIZE", chunk_size)
+    assert extract_items(html, 100) == expected
+
+def test_extract_items_card_fields(read_page):
+    items = extract_items(read_page("category.html"), 100)
+    assert all(item["url"].startswith("https://www.ozon.ru/product/") and "?" not in item["url"] for item in items)
+    # Карточка без цены и карточки без картинки остаются в выдаче
+    assert any(item["price"] == "Цена не найдена" for item in items)
+    assert any(item["img"] is None for item in items)
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import ozon_observe_tg
+from ozon_observe_tg import extract_items, extract_items_from_state, fetch_stats_summary, fetch_via_http, parse_page
+
+# Записанные ответы Ozon (сокращенные): выдача со встроенным состоянием, выдача только с карточками,
+# заглушка антибота и состояние, у которого в значении соседнего атрибута встречается ">"
+TESTS_DIR = os.path.dirname(__file__)
+ROUTES = {
+    "/category/smartfony-15502/": (200, "pages/category.html"),
+    "/search/?text=naushniki": (200, "pages/search.html"),
+    "/category/cards-only/": (200, "responses/cards_only.html"),
+    "/brand/tefal-33375/": (200, "responses/state_quoted_gt.html"),
+    "/category/blocked/": (200, "responses/blocked.html"),
+    "/category/forbidden/": (403, "responses/blocked.html"),
+}
+
+def read_fixture(name):
+    with open(os.path.join(TESTS_DIR, name), "rb") as f:
+        return f.read()
+
+class RecordedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, name = ROUTES.get(self.path, (404, "responses/blocked.html"))
+        body = read_fixture(name)
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Локальный сервер вместо Ozon, отдающий записанные ответы
+@pytest.fixture(scope="module")
+def ozon_site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+# HTTP-клиент и поток разбора, которые бот создает при запуске
+@pytest.fixture
+def scraper(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(ozon_observe_tg, "parse_executor", executor)
+    monkeypatch.setattr(ozon_observe_tg, "ozon_http", None)
+    monkeypatch.setattr(ozon_observe_tg, "HTTP_FETCH_ENABLED", True)
+    monkeypatch.setattr(ozon_observe_tg, "fetch_stats", OrderedDict())
+
+    def run(func, *args):
+        async def main():
+            async with httpx.AsyncClient(timeout=5) as client:
+                ozon_observe_tg.ozon_http = client
+                return await func(*args)
+        return asyncio.run(main())
+
+    yield run
+    executor.shutdown()
+
+# Подмена загрузки через браузер: запоминает URL и возвращает заранее заданные товары
+@pytest.fixture
+def browser(monkeypatch):
+    calls = []
+    items = [{"url": "https://www.ozon.ru/product/from-browser-1/", "price": "100 ₽", "img": None}]
+
+    async def fake_fetch_via_browser(url):
+        calls.append(url)
+        return items
+
+    monkeypatch.setattr(ozon_observe_tg, "fetch_via_browser", fake_fetch_via_browser)
+    return calls, items
+
+@pytest.mark.parametrize("name", ["pages/category.html", "pages/search.html", "pages/brand.html"])
+def test_state_matches_cards(name):
+    html = read_fixture(name)
+    state_items = extract_items_from_state(html, 100)
+    assert state_items
+    # Во встроенном состоянии те же товары, что и в карточках со ссылкой, и те же цены
+    card_items = extract_items(html, 100)
+    assert [item["url"] for item in state_items] == [item["url"] for item in card_items]
+    for state_item, card_item in zip(state_items, card_items):
+        if card_item["price"] != "Цена не найдена":
+            assert state_item["price"] == card_item["price"]
+
+def test_state_limit():
+    assert len(extract_items_from_state(read_fixture("pages/category.html"), 3)) == 3
+
+def test_state_with_gt_in_attribute_value():
+    items = extract_items_from_state(read_fixture("responses/state_quoted_gt.html"))
+    assert items == [
+        {
+            "url": "https://www.ozon.ru/product/skovoroda-tefal-ultimate-26-sm-1392581543/",
+            "price": "2 990 ₽",
+            "img": "https://ir.ozone.ru/s3/multimedia-1-x/wc500/7012345678.jpg",
+        },
+        {
+            "url": "https://www.ozon.ru/product/skovoroda-tefal-intensium-24-sm-139258-1/",
+            "price": "1 749 ₽",
+            "img": None,
+        },
+    ]
+
+def test_state_missing():
+    assert extract_items_from_state(read_fixture("responses/cards_only.html")) == []
+    assert extract_items_from_state(read_fixture("responses/blocked.html")) == []
+
+@pytest.mark.parametrize("path", ["/search/?text=naushniki", "/brand/tefal-33375/"])
+def test_fetch_via_http_state(ozon_site, scraper, path):
+    items = scraper(fetch_via_http, ozon_site + path)
+    assert items
+    assert items == extract_items_from_state(read_fixture(ROUTES[path][1]))
+
+def test_fetch_via_http_cards_only(ozon_site, scraper):
+    items = scraper(fetch_via_http, ozon_site + "/category/cards-only/")
+    assert items == extract_items(read_fixture("responses/cards_only.html"))
+    assert items
+
+@pytest.mark.parametrize("path", ["/category/blocked/", "/category/forbidden/"])
+def test_fetch_via_http_no_items(ozon_site, scraper, path):
+    assert scraper(fetch_via_http, ozon_site + path) == []
+
+def test_parse_page_uses_http(ozon_site, scraper, browser):
+    calls, _ = browser
+    url = ozon_site + "/category/smartfony-15502/"
+    items = scraper(parse_page, url)
+    assert items == extract_items_from_state(read_fixture("pages/category.html"))
+    assert calls == []
+    assert ozon_observe_tg.fetch_stats[url]["http"] == 1
+
+# Заглушка антибота или ошибка HTTP: страница загружается браузером
+@pytest.mark.parametrize("path", ["/category/blocked/", "/category/forbidden/"])
+def test_parse_page_falls_back_to_browser(ozon_site, scraper, browser, path):
+    calls, browser_items = browser
+    url = ozon_site + path
+    assert scraper(parse_page, url) == browser_items
+    assert calls == [url]
+    assert ozon_observe_tg.fetch_stats[url]["browser"] == 1
+
+def test_parse_page_http_disabled(ozon_site, scraper, browser, monkeypatch):
+    calls, browser_items = browser
+    monkeypatch.setattr(ozon_observe_tg, "HTTP_FETCH_ENABLED", False)
+    url = ozon_site + "/category/smartfony-15502/"
+    assert scraper(parse_page, url) == browser_items
+    assert calls == [url]
+
+# Статистика хранится для ограниченного числа страниц, в сводку попадают страницы, загруженные браузером
+def test_fetch_stats_bounded(ozon_site, scraper, browser, monkeypatch):
+    monkeypatch.setattr(ozon_observe_tg, "FETCH_STATS_SIZE", 2)
+    paths = ["/category/blocked/", "/category/forbidden/", "/category/smartfony-15502/"]
+    for path in paths:
+        scraper(parse_page, ozon_site + path)
+    assert list(ozon_observe_tg.fetch_stats) == [ozon_site + path for path in paths[1:]]
+    assert fetch_stats_summary() == [f"{ozon_site}/category/forbidden/: http 0, браузер 1, не загружена 0"]
@@ -0,0 +1,120 @@
+import os
+import random
+from collections import defaultdict
+
+import pytest
+
+import ozon_observe_tg
+from ozon_observe_tg import HISTORY_BUCKET_SECONDS, HISTORY_RAW_DAYS, HISTORY_RETENTION_DAYS, PriceHistory
+
+PRODUCT = "https://www.ozon.ru/product/smartfon-1392581543/"
+DAY = 86400
+START = 19700 * DAY  # Начало суток, чтобы интервалы прореживания совпадали с днями
+
+def poll(history, price, now, url=PRODUCT):
+    history.record([{"url": url, "price": f"{price} ₽", "img": None}], now=now)
+
+@pytest.fixture
+def history(tmp_path):
+    return PriceHistory(str(tmp_path / "history"))
+
+def points(history, url=PRODUCT):
+    times, prices = history.read(url)
+    return list(zip(times, prices))
+
+# Товар опрашивается раз в час 400 дней, цена меняется в среднем раз в 10 часов
+@pytest.fixture
+def year_of_polls(history):
+    rng = random.Random(0)
+    price = 10000
+    for hour in range(400 * 24):
+        if rng.random() < 0.1:
+            price = max(1000, price + rng.choice([-500, -100, 100, 500]))
+        poll(history, price, START + hour * 3600)
+    return START + 400 * DAY
+
+def test_compact_file_downsamples_and_expires(history, year_of_polls):
+    now = year_of_polls
+    path = history.path(PRODUCT)
+    before = points(history)
+    assert history.compact_file(path, now=now)
+    after = points(history)
+    assert len(after) < len(before)
+
+    expire_before = now - HISTORY_RETENTION_DAYS * DAY
+    raw_after = now - HISTORY_RAW_DAYS * DAY
+    assert after[0][0] >= expire_before
+    # Последние HISTORY_RAW_DAYS дней не прореживаются
+    assert [point for point in after if point[0] >= raw_after] == [point for point in before if point[0] >= raw_after]
+
+    # Раньше - минимум и максимум за каждый интервал, в порядке времени
+    buckets_before, buckets_after = defaultdict(list), defaultdict(list)
+    for point in before:
+        if expire_before <= point[0] < raw_after:
+            buckets_before[point[0] // HISTORY_BUCKET_SECONDS].append(point)
+    for point in after:
+        if point[0] < raw_after:
+            buckets_after[point[0] // HISTORY_BUCKET_SECONDS].append(point)
+    assert buckets_after.keys() == buckets_before.keys()
+    for bucket, kept in buckets_after.items():
+        original = buckets_before[bucket]
+        assert 1 <= len(kept) <= 2
+        assert set(kept) <= set(original)
+        assert kept == sorted(kept)
+        assert min(price for _, price in kept) == min(price for _, price in original)
+        assert max(price for _, price in kept) == max(price for _, price in original)
+
+    # Повторное прореживание в тот же момент ничего не меняет
+    assert not history.compact_file(path, now=now)
+    assert points(history) == after
+
+def test_compact_file_recent_history_unchanged(history):
+    for day in range(HISTORY_RAW_DAYS - 1):
+        poll(history, 1000 + day, START + day * DAY)
+    before = points(history)
+    assert not history.compact_file(history.path(PRODUCT), now=START + HISTORY_RAW_DAYS * DAY)
+    assert points(history) == before
+
+# Файл, в котором все точки старше HISTORY_RETENTION_DAYS, удаляется вместе с последней точкой в памяти
+def test_compact_file_removes_expired(history):
+    poll(history, 1000, START)
+    path = history.path(PRODUCT)
+    assert history._last[path] == (START, 1000.0)
+    assert history.compact_file(path, now=START + (HISTORY_RETENTION_DAYS + 1) * DAY)
+    assert not os.path.exists(path)
+    assert path not in history._last
+    # Следующая цена снова записывается
+    poll(history, 1000, START + (HISTORY_RETENTION_DAYS + 1) * DAY)
+    assert points(history) == [(START + (HISTORY_RETENTION_DAYS + 1) * DAY, 1000.0)]
+
+def last_day_polls(history, url=PRODUCT):
+    # В последний день истории максимум, затем минимум, затем промежуточная цена
+    poll(history, 1000, START, url)
+    poll(history, 2000, START + 3600, url)
+    poll(history, 500, START + 7200, url)
+    poll(history, 800, START + 10800, url)
+
+# После прореживания последней точкой становится минимум последнего дня
+def test_compact_file_updates_cached_last_point(history):
+    last_day_polls(history)
+    path = history.path(PRODUCT)
+    assert history.compact_file(path, now=START + (HISTORY_RAW_DAYS + 1) * DAY)
+    assert points(history) == [(START + 3600, 2000.0), (START + 7200, 500.0)]
+    assert history._last[path] == (START + 7200, 500.0)
+    # Цена 500 совпадает с последней точкой и не записывается, 800 - записывается
+    poll(history, 500, START + 7200 + 3600)
+    poll(history, 800, START + 7200 + 7200)
+    assert points(history)[-1] == (START + 7200 + 7200, 800.0)
+
+# Прореживание не добавляет в кэш последних точек товары, которых там нет
+def test_compact_file_does_not_cache_new_paths(history, monkeypatch):
+    monkeypatch.setattr(ozon_observe_tg, "HISTORY_LAST_POINTS_CACHE", 1)
+    other = "https://www.ozon.ru/product/naushniki-123456/"
+    last_day_polls(history)
+    poll(history, 1000, START, other)  # Вытесняет PRODUCT из кэша
+    path = history.path(PRODUCT)
+    assert list(history._last) == [history.path(other)]
+    assert history.compact_file(path, now=START + (HISTORY_RAW_DAYS + 1) * DAY)
+    assert list(history._last) == [history.path(other)]
+    # Последняя точка читается с диска уже прореженной
+    assert history._last_point(path) == (START + 7200, 500.0)
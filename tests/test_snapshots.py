@@ -0,0 +1,74 @@
+import pytest
+
+import ozon_observe_tg
+from ozon_observe_tg import SnapshotStore, listing_fingerprint
+
+KEY = "https://www.ozon.ru/category/smartfony-15502/"
+PRODUCT = "https://www.ozon.ru/product/smartfon-1392581543/"
+
+def listing(*prices):
+    return [
+        {"url": f"https://www.ozon.ru/product/tovar-{index}/", "price": f"{price} ₽", "img": None}
+        for index, price in enumerate(prices)
+    ]
+
+def poll(store, items):
+    return store.update(KEY, items, listing_fingerprint(items))
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(ozon_observe_tg, "PRICE_CHANGE_THRESHOLD", 0.05)
+    snapshots = SnapshotStore(str(tmp_path / "ozon.db"))
+    yield snapshots
+    snapshots.close()
+
+def test_new_items_reported_once(store):
+    items = listing(1000, 2000)
+    assert poll(store, items) == items
+    assert poll(store, items) == []
+    assert store.fingerprint(KEY) == listing_fingerprint(items)
+
+def test_price_change_over_threshold(store):
+    poll(store, listing(1000))
+    assert poll(store, listing(1040)) == []
+    changes = poll(store, listing(900))
+    assert [(item["price"], item["old_price"]) for item in changes] == [("900 ₽", 1000)]
+    # После сообщения сравнение идет с новой ценой
+    assert poll(store, listing(880)) == []
+
+# Цена снижается на 3% за опрос: каждое снижение меньше порога, но накопленное изменение
+# должно сообщаться, как только превысит порог относительно последней сообщенной цены
+def test_gradual_drift_reported(store):
+    prices = [1000]
+    while len(prices) < 10:
+        prices.append(round(prices[-1] * 0.97))
+    reports = []
+    for price in prices:
+        for item in poll(store, [{"url": PRODUCT, "price": f"{price} ₽", "img": None}]):
+            reports.append((item.get("old_price"), price))
+    assert reports[0] == (None, 1000)
+    assert len(reports) > 1
+    baseline = 1000
+    for old_price, price in reports[1:]:
+        assert old_price == baseline
+        assert (baseline - price) / baseline >= 0.05
+        baseline = price
+    # Последняя цена отличается от последней сообщенной меньше чем на порог
+    assert (baseline - prices[-1]) / baseline < 0.05
+
+def test_unchanged_items_stay_fresh(store, monkeypatch):
+    items = listing(1000)
+    poll(store, items)
+    now = ozon_observe_tg.time.time()
+    later = now + (ozon_observe_tg.SNAPSHOT_TTL_DAYS - 1) * 86400
+    monkeypatch.setattr(ozon_observe_tg.time, "time", lambda: later)
+    assert poll(store, items) == []
+    # Время, когда товар видели, обновилось, хотя цена не менялась: товар не удаляется по сроку
+    monkeypatch.setattr(ozon_observe_tg.time, "time", lambda: later + 2 * 86400)
+    assert poll(store, items) == []
+
+def test_missing_price_then_price(store):
+    items = [{"url": PRODUCT, "price": "Цена не найдена", "img": None}]
+    assert poll(store, items) == items
+    assert poll(store, [{"url": PRODUCT, "price": "500 ₽", "img": None}]) == []
+    assert poll(store, [{"url": PRODUCT, "price": "400 ₽", "img": None}])[0]["old_price"] == 500
@@ -0,0 +1,149 @@
+import math
+import os
+import random
+
+import pytest
+
+MB = 1024 * 1024
+
+# youtube2tg при импорте пишет журнал в bot.log текущего каталога: импортируем его из временного
+@pytest.fixture(scope="module")
+def youtube2tg(tmp_path_factory):
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("youtube2tg"))
+    try:
+        import youtube2tg
+    finally:
+        os.chdir(cwd)
+    return youtube2tg
+
+# Индекс ключевых кадров (время, смещение) с заданными размерами GOP, кадр каждые 2 секунды
+def make_keyframes(gop_sizes):
+    keyframes = []
+    offset = 0
+    for index, size in enumerate(gop_sizes):
+        keyframes.append((index * 2.0, offset))
+        offset += size
+    return keyframes, offset
+
+# Размеры частей, на которые видео разрежут по временам из plan_cuts
+def part_sizes(keyframes, total_size, cuts):
+    offsets = dict(keyframes)
+    bounds = [0] + [offsets[cut] for cut in cuts] + [total_size]
+    return [end - start for start, end in zip(bounds, bounds[1:])]
+
+# Наименьшее возможное число частей не больше limit с разрезами только по ключевым кадрам
+def min_parts(keyframes, total_size, limit):
+    bounds = [offset for _, offset in keyframes] + [total_size]
+    best = [0] + [math.inf] * (len(bounds) - 1)
+    for end in range(1, len(bounds)):
+        for start in range(end - 1, -1, -1):
+            if bounds[end] - bounds[start] > limit:
+                break
+            best[end] = min(best[end], best[start] + 1)
+    return best[-1]
+
+def test_plan_cuts_fits_in_one_part(youtube2tg):
+    keyframes, total_size = make_keyframes([MB] * 10)
+    assert youtube2tg.plan_cuts(keyframes, total_size, 10 * MB) == []
+
+def test_plan_cuts_uniform(youtube2tg):
+    keyframes, total_size = make_keyframes([MB] * 100)
+    cuts = youtube2tg.plan_cuts(keyframes, total_size, 30 * MB)
+    # Каждая часть заполняется до лимита: 30 + 30 + 30 + 10
+    assert cuts == [60.0, 120.0, 180.0]
+    assert part_sizes(keyframes, total_size, cuts) == [30 * MB, 30 * MB, 30 * MB, 10 * MB]
+
+@pytest.mark.parametrize("seed", range(20))
+def test_plan_cuts_fewest_parts(youtube2tg, seed):
+    rng = random.Random(seed)
+    keyframes, total_size = make_keyframes([rng.randint(MB // 10, 3 * MB) for _ in range(200)])
+    limit = 20 * MB
+    cuts = youtube2tg.plan_cuts(keyframes, total_size, limit)
+    sizes = part_sizes(keyframes, total_size, cuts)
+    assert max(sizes) <= limit
+    assert len(sizes) == min_parts(keyframes, total_size, limit)
+
+# Длинное видео с переменным битратом: статичные сцены чередуются с динамичными
+def test_plan_cuts_vbr(youtube2tg):
+    rng = random.Random(0)
+    gop_sizes = []
+    while sum(gop_sizes) < 3600 * MB:
+        scene_rate = rng.choice([0.2, 0.5, 1, 2, 4]) * MB
+        gop_sizes += [int(scene_rate * rng.uniform(0.5, 1.5)) for _ in range(rng.randint(10, 200))]
+    keyframes, total_size = make_keyframes(gop_sizes)
+    limit = 50 * MB - youtube2tg.PART_HEADROOM
+    cuts = youtube2tg.plan_cuts(keyframes, total_size, limit)
+    sizes = part_sizes(keyframes, total_size, cuts)
+    assert max(sizes) <= limit
+    assert sorted(cuts) == cuts
+    assert len(sizes) == min_parts(keyframes, total_size, limit)
+    # Не больше пары частей сверх нижней границы по общему размеру
+    assert len(sizes) <= math.ceil(total_size / limit) + 2
+
+# GOP больше лимита: отдельная часть от его ключевого кадра до следующего, остальные в лимите
+def test_plan_cuts_gop_larger_than_limit(youtube2tg):
+    keyframes, total_size = make_keyframes([MB] * 5 + [25 * MB] + [MB] * 5)
+    cuts = youtube2tg.plan_cuts(keyframes, total_size, 10 * MB)
+    assert cuts == [10.0, 12.0]
+    assert part_sizes(keyframes, total_size, cuts) == [5 * MB, 25 * MB, 5 * MB]
+
+def test_plan_cuts_last_gop_larger_than_limit(youtube2tg):
+    keyframes, total_size = make_keyframes([MB] * 5 + [25 * MB])
+    cuts = youtube2tg.plan_cuts(keyframes, total_size, 10 * MB)
+    assert part_sizes(keyframes, total_size, cuts) == [5 * MB, 25 * MB]
+
+# Форматы как в ответе yt-dlp для видео длительностью 600 секунд
+DURATION = 600
+FORMATS = [
+    {"format_id": "18", "ext": "mp4", "height": 360, "vcodec": "avc1", "acodec": "mp4a", "tbr": 600, "filesize": 45 * MB},
+    {"format_id": "140", "ext": "m4a", "height": None, "vcodec": "none", "acodec": "mp4a", "abr": 128, "filesize": 9 * MB},
+    {"format_id": "251", "ext": "webm", "height": None, "vcodec": "none", "acodec": "opus", "abr": 160, "filesize": 11 * MB},
+    {"format_id": "134", "ext": "mp4", "height": 360, "vcodec": "avc1", "acodec": "none", "tbr": 300, "filesize": 22 * MB},
+    {"format_id": "135", "ext": "mp4", "height": 480, "vcodec": "avc1", "acodec": "none", "tbr": 500, "filesize": 36 * MB},
+    {"format_id": "136", "ext": "mp4", "height": 720, "vcodec": "avc1", "acodec": "none", "tbr": 1200, "filesize": 90 * MB},
+    {"format_id": "137", "ext": "mp4", "height": 1080, "vcodec": "avc1", "acodec": "none", "tbr": 2500, "filesize": 190 * MB},
+]
+
+def video_info(formats=FORMATS):
+    return {"duration": DURATION, "formats": formats}
+
+@pytest.mark.parametrize("limit, selector, size", [
+    (2000 * MB, "136+140", 99 * MB),  # 1080p выше MAX_HEIGHT
+    (105 * MB, "136+140", 99 * MB),
+    (100 * MB, "135+140", 45 * MB),  # 720p не укладывается в запас FORMAT_SIZE_MARGIN
+    (50 * MB, "135+140", 45 * MB),
+    (47 * MB, "134+140", 31 * MB),  # Формат 18 той же высоты с большим битратом не помещается
+])
+def test_plan_format_fits(youtube2tg, limit, selector, size):
+    assert youtube2tg.plan_format(video_info(), limit) == (selector, size)
+
+# Ниже MIN_FIT_HEIGHT качество не снижается: выбирается лучший формат, его разобьют на части
+def test_plan_format_nothing_fits(youtube2tg):
+    formats = FORMATS + [
+        {"format_id": "160", "ext": "mp4", "height": 144, "vcodec": "avc1", "acodec": "none", "tbr": 100, "filesize": 7 * MB},
+    ]
+    assert youtube2tg.plan_format(video_info(formats), 30 * MB) == ("136+140", 99 * MB)
+
+def test_plan_format_prefers_m4a(youtube2tg):
+    # Звук opus с большим битратом идет после m4a: m4a склеивается в mp4 без перекодирования
+    assert youtube2tg.plan_format(video_info(), 2000 * MB)[0].endswith("+140")
+    formats = [fmt for fmt in FORMATS if fmt["format_id"] != "140"]
+    assert youtube2tg.plan_format(video_info(formats), 2000 * MB) == ("136+251", 101 * MB)
+
+def test_plan_format_size_from_bitrate(youtube2tg):
+    formats = [
+        {"format_id": "22", "ext": "mp4", "height": 720, "vcodec": "avc1", "acodec": "mp4a", "tbr": 1000},
+        {"format_id": "18", "ext": "mp4", "height": 360, "vcodec": "avc1", "acodec": "mp4a", "filesize_approx": 40 * MB},
+    ]
+    # 1000 кбит/с за 600 секунд - 75 000 000 байт
+    assert youtube2tg.plan_format(video_info(formats), 100 * MB) == ("22", 75_000_000)
+    assert youtube2tg.plan_format(video_info(formats), 60 * MB) == ("18", 40 * MB)
+
+@pytest.mark.parametrize("formats", [
+    [],
+    [fmt for fmt in FORMATS if fmt["format_id"] in ("140", "251", "137")],  # Только звук и видео выше MAX_HEIGHT
+    [{"format_id": "136", "ext": "mp4", "height": 720, "vcodec": "avc1", "acodec": "none"}],  # Размер неизвестен
+])
+def test_plan_format_no_candidates(youtube2tg, formats):
+    assert youtube2tg.plan_format(video_info(formats), 50 * MB) is None
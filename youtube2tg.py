@@ -1,9 +1,17 @@
 import re
 import time
 import os
-import subprocess
-import requests
+import asyncio
+import contextlib
+import json
+import math
+import shutil
+import tempfile
+import uuid
 import logging
+from collections import OrderedDict, deque
+import httpx
+import metrics
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
 
@@ -23,97 +31,818 @@ httpx_logger.setLevel(logging.WARNING)  # Показывать только пр
 
 # Ваш Telegram токен
 TOKEN = "YOUR:TOKEN"
+TELEGRAM_API_URL = "https://api.telegram.org"  # Адрес Bot API
+# Адрес своего сервера telegram-bot-api, запущенного с --local на этой же машине (None - не использовать).
+# Через него видео до 2 ГБ отправляются по пути к файлу, без загрузки по HTTP и без разбиения на части
+LOCAL_BOT_API_URL = None
+LOCAL_MAX_FILE_SIZE = 2000 * 1024 * 1024  # Максимальный размер файла для своего сервера Bot API
 YOUTUBE_REGEX = r"^https://www\.youtube\.com/(watch\?v=|live/)[a-zA-Z0-9_-]{1,15}$"
+VIDEO_ID_REGEX = re.compile(r"(?:watch\?v=|live/)([a-zA-Z0-9_-]{1,15})")  # ID видео из URL
+METRICS_PORT = 9101  # Порт для метрик Prometheus (None - не запускать)
 
 # Время задержки между запросами (3 минуты)
 TIME_LIMIT = 180
 last_message_time = {}  # Словарь для хранения времени последнего запроса
 allowed_ids = []  # ID пользователей, которым разрешено использовать бота
+admin_ids = []  # ID администраторов (доступна команда /stats)
 
 # Максимальный размер файла Telegram (50 МБ)
 MAX_FILE_SIZE = 52428700
+local_api = False  # Используется ли свой сервер Bot API (определяется при запуске)
+max_upload_size = MAX_FILE_SIZE  # Файлы больше этого размера разбиваются на части
+
+VIDEO_WORKERS = 2  # Сколько видео обрабатывается одновременно
+PROGRESS_INTERVAL = 5  # Как часто обновлять сообщение о ходе обработки, секунд
+UPLOAD_TIMEOUT = 600  # Таймаут запросов к Bot API (отправка больших файлов), секунд
+WORK_DIR = None  # Каталог для временных файлов заданий (None - системный временный каталог)
+MAX_PART_SIZE = 50000000  # Размер части при разбиении по битрейту, чуть меньше 50 МБ
+PART_HEADROOM = 1000000  # Запас на заголовки MP4 при разбиении по ключевым кадрам, байт
+PACKET_OVERHEAD = 24  # Примерный размер записи о пакете в индексе MP4 (moov), байт
+SEGMENT_POLL_INTERVAL = 0.5  # Как часто проверять, не готова ли следующая часть, секунд
+# Скачивание сразу в ffmpeg через канал: нарезка идет одновременно со скачиванием.
+# Работает только с форматами из одного файла (без склейки видео и звука), поэтому качество может быть ниже
+PIPE_DOWNLOAD = False
+VIDEO_FORMAT = "bv*[height<=720]+ba/best"  # Формат yt-dlp, если подобрать формат заранее не удалось
+MAX_HEIGHT = 720  # Максимальная высота кадра при подборе формата
+MIN_FIT_HEIGHT = 360  # Ниже этой высоты качество не снижается ради отправки одним файлом
+FORMAT_SIZE_MARGIN = 0.95  # Доля лимита, в которую должен уложиться оценочный размер формата
+VIDEO_INFO_CACHE_SIZE = 1000  # Сколько сведений о форматах видео помнить
+VIDEO_INFO_TTL = 6 * 3600  # Сколько секунд считать сведения о форматах актуальными
+PIPE_FORMAT = "best[height<=720][ext=mp4]/best[height<=720]"  # Формат yt-dlp для PIPE_DOWNLOAD
+VIDEO_CACHE_FILE = "video_cache.json"  # Кэш file_id уже отправленных видео
+VIDEO_CACHE_SIZE = 5000  # Сколько видео помнить
+VIDEO_CACHE_TTL = 30 * 86400  # Сколько секунд хранить запись кэша
+DOWNLOAD_PROGRESS_REGEX = re.compile(r"\[download\]\s+([\d.]+)%")  # Строка прогресса yt-dlp
+
+job_queue = None  # Очередь видео, создается при запуске
+workers = []  # Задачи обработчиков очереди
+http_client = None  # HTTP-клиент для Bot API
+video_cache = None  # Кэш file_id отправленных видео, загружается при запуске
+video_info_cache = OrderedDict()  # ID видео -> (время запроса, сведения о форматах)
+videos_in_flight = {}  # ID видео -> событие окончания его обработки (повторные запросы ждут его вне обработчиков)
+
+# Метрики
+download_seconds = metrics.Histogram("yt_download_seconds", "Время скачивания видео через yt-dlp")
+split_seconds = metrics.Histogram("yt_split_seconds", "Время разбиения видео через ffmpeg")
+upload_seconds = metrics.Histogram("yt_upload_seconds", "Время отправки одного файла в Telegram")
+upload_bytes_total = metrics.Counter("yt_upload_bytes_total", "Байт видео, отправленных в Telegram (upload - загружено, local_path - передан путь своему серверу)")
+videos_total = metrics.Counter("yt_videos_total", "Обработанные запросы по результату (ok, failed)")
+video_info_seconds = metrics.Histogram("yt_video_info_seconds", "Время получения сведений о форматах (yt-dlp -J)")
+video_info_lookups = metrics.Counter("yt_video_info_lookups_total", "Запросы сведений о форматах (hit - из кэша, miss)")
+download_bytes_total = metrics.Counter("yt_download_bytes_total", "Скачано байт видео")
+videos_in_progress = metrics.Gauge("yt_videos_in_progress", "Видео в обработке")
+queue_length = metrics.Gauge("yt_queue_length", "Видео в очереди", function=lambda: len(job_queue) if job_queue else 0)
+queue_wait_seconds = metrics.Histogram("yt_queue_wait_seconds", "Время ожидания видео в очереди")
+metrics.Gauge("yt_video_cache_hits", "Видео отправлены из кэша file_id", lambda: video_cache.hits if video_cache else 0)
+metrics.Gauge("yt_video_cache_misses", "Видео не найдены в кэше file_id", lambda: video_cache.misses if video_cache else 0)
+metrics.Gauge("yt_video_cache_hit_ratio", "Доля запросов, отправленных из кэша", lambda: video_cache.hit_ratio() if video_cache else 0)
+metrics.Gauge("yt_video_cache_entries", "Видео в кэше file_id", lambda: len(video_cache) if video_cache else 0)
+
+class VideoCache:
+    """Кэш file_id отправленных видео: ключ - ID видео и способ отправки, значение - file_id видео или его частей
+    и формат, в котором видео было отправлено."""
+
+    def __init__(self, path, max_size, ttl):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # Ключ -> {"file_ids": [...], "format": формат yt-dlp, "time": время отправки}
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self._entries = OrderedDict(json.load(f))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            logger.info(f"Загружен кэш видео: {len(self._entries)} записей.")
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.error(f"Файл {self.path} поврежден, кэш видео начат заново: {e}")
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(list(self._entries.items()), f)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def get(self, key):
+        """Запись {"file_ids": [...], "format": ...}; None, если записи нет или она устарела."""
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry["time"] > self.ttl:
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, file_ids, video_format):
+        self._entries[key] = {"file_ids": file_ids, "format": video_format, "time": time.time()}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self.save()
+
+    def discard(self, key):
+        if self._entries.pop(key, None) is not None:
+            self.save()
+
+def video_id(url):
+    """Канонический ID видео YouTube для URL вида watch?v= и live/."""
+    match = VIDEO_ID_REGEX.search(url)
+    return match.group(1) if match else url
+
+def cache_key(video, mode):
+    return f"{video}:{mode}"
+
+def delivery_mode():
+    """Способ отправки, от которого зависят формат и разбиение на части: ключ кэша вместе с ID видео."""
+    if local_api:
+        return "local-api"
+    return "pipe" if PIPE_DOWNLOAD else "file"
+
+class VideoJob:
+    """Запрос пользователя на скачивание одного видео."""
+
+    def __init__(self, url, user_id):
+        self.id = uuid.uuid4().hex[:8]
+        self.url = url
+        self.user_id = user_id
+        self.created = time.monotonic()
+        self.status_message_id = None  # Сообщение, в котором показывается ход обработки
+        self.last_status_time = 0
+        self.task = None  # Задача обработки, пока видео обрабатывается
+        self.done = asyncio.Event()
+
+class JobQueue:
+    """Очередь видео: пользователи обслуживаются по кругу, по одному видео за раз."""
+
+    def __init__(self):
+        self.pending = {}  # ID пользователя -> очередь его видео
+        self.order = deque()  # Пользователи в порядке обслуживания
+        self.running = set()  # Видео в обработке
+        self.idle = 0  # Обработчики, ожидающие видео
+        self._changed = asyncio.Condition()
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self.pending.values())
+
+    async def put(self, job):
+        """Добавляет видео в очередь и возвращает его позицию."""
+        async with self._changed:
+            if job.user_id not in self.pending:
+                self.pending[job.user_id] = deque()
+                self.order.append(job.user_id)
+            self.pending[job.user_id].append(job)
+            self._changed.notify()
+        return self.position(job)
+
+    async def get(self):
+        """Ждет и возвращает следующее видео."""
+        async with self._changed:
+            self.idle += 1
+            try:
+                while not self.order:
+                    await self._changed.wait()
+            finally:
+                self.idle -= 1
+            user_id = self.order.popleft()
+            jobs = self.pending[user_id]
+            job = jobs.popleft()
+            if jobs:
+                self.order.append(user_id)
+            else:
+                del self.pending[user_id]
+            self.running.add(job)
+            return job
+
+    def finish(self, job):
+        self.running.discard(job)
+        job.done.set()
+
+    def position(self, job):
+        """Номер видео в очереди (1 - следующее) или None, если его там нет."""
+        pending = {user_id: list(jobs) for user_id, jobs in self.pending.items()}
+        order = list(self.order)
+        position = 0
+        while order:
+            user_id = order.pop(0)
+            position += 1
+            if pending[user_id].pop(0) is job:
+                return position
+            if pending[user_id]:
+                order.append(user_id)
+        return None
+
+    def cancel(self, user_id):
+        """Отменяет все видео пользователя (и ожидающие, и обрабатываемые); возвращает их количество."""
+        cancelled = 0
+        for job in self.pending.pop(user_id, ()):
+            job.done.set()
+            cancelled += 1
+        if user_id in self.order:
+            self.order.remove(user_id)
+        for job in list(self.running):
+            if job.user_id == user_id and job.task is not None:
+                job.task.cancel()
+                cancelled += 1
+        return cancelled
 
 # Функции для работы с Telegram API
-def send_video(file_path, user_id, caption):
-    """Отправляет видео пользователю через Telegram Bot API."""
-    url = f"https://api.telegram.org/bot{TOKEN}/sendVideo"
+@metrics.timed(upload_seconds)
+async def send_video(file_path, user_id, caption):
+    """Отправляет видео пользователю через Telegram Bot API и возвращает его file_id."""
+    url = f"{TELEGRAM_API_URL}/bot{TOKEN}/sendVideo"
+    data = {'chat_id': user_id, 'caption': caption, 'supports_streaming': True}
     try:
+        if local_api:
+            # Свой сервер читает файл сам: передаем только путь
+            response = await http_client.post(url, data=dict(data, video=f"file://{os.path.abspath(file_path)}"))
+            if response.status_code == 200:
+                upload_bytes_total.inc(os.path.getsize(file_path), transfer="local_path")
+                logger.info(f"Видео {file_path} успешно отправлено пользователю {user_id} по пути к файлу.")
+                return video_file_id(response.json()["result"])
+            logger.error(f"Сервер Bot API не принял видео {file_path} по пути: {response.text}")
+            if os.path.getsize(file_path) > MAX_FILE_SIZE:
+                return None
         with open(file_path, 'rb') as video_file:
-            files = {'video': video_file}
-            data = {'chat_id': user_id, 'caption': caption, 'supports_streaming': True}
-            response = requests.post(url, files=files, data=data)
+            response = await http_client.post(url, files={'video': video_file}, data=data)
             if response.status_code == 200:
+                upload_bytes_total.inc(os.path.getsize(file_path), transfer="upload")
                 logger.info(f"Видео {file_path} успешно отправлено пользователю {user_id}.")
-            else:
-                logger.error(f"Ошибка отправки видео пользователю {user_id}: {response.text}")
+                return video_file_id(response.json()["result"])
+            logger.error(f"Ошибка отправки видео пользователю {user_id}: {response.text}")
     except Exception as e:
         logger.exception(f"Ошибка при отправке видео {file_path}: {e}")
+    return None
+
+async def send_video_by_id(file_id, user_id, caption):
+    """Отправляет уже загруженное в Telegram видео по file_id; возвращает True при успехе."""
+    url = f"{TELEGRAM_API_URL}/bot{TOKEN}/sendVideo"
+    data = {'chat_id': user_id, 'video': file_id, 'caption': caption, 'supports_streaming': True}
+    try:
+        response = await http_client.post(url, data=data)
+        if response.status_code == 200:
+            return True
+        logger.warning(f"Не удалось отправить видео {file_id} из кэша пользователю {user_id}: {response.text}")
+    except Exception as e:
+        logger.exception(f"Ошибка при отправке видео {file_id} из кэша: {e}")
+    return False
+
+def video_file_id(message):
+    """file_id из ответа на sendVideo (большие файлы Telegram может вернуть как документ)."""
+    media = message.get("video") or message.get("document") or {}
+    return media.get("file_id")
+
+async def send_message(user_id, text):
+    """Отправляет текстовое сообщение и возвращает его ID."""
+    url = f"{TELEGRAM_API_URL}/bot{TOKEN}/sendMessage"
+    try:
+        response = await http_client.post(url, data={'chat_id': user_id, 'text': text})
+        if response.status_code != 200:
+            logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {response.text}")
+            return None
+        return response.json()["result"]["message_id"]
+    except Exception as e:
+        logger.exception(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
+        return None
+
+async def update_status(job, text, force=False):
+    """Обновляет сообщение о ходе обработки видео (не чаще PROGRESS_INTERVAL секунд)."""
+    now = time.monotonic()
+    if not force and now - job.last_status_time < PROGRESS_INTERVAL:
+        return
+    job.last_status_time = now
+    if job.status_message_id is None:
+        job.status_message_id = await send_message(job.user_id, text)
+        return
+    url = f"{TELEGRAM_API_URL}/bot{TOKEN}/editMessageText"
+    data = {'chat_id': job.user_id, 'message_id': job.status_message_id, 'text': text}
+    try:
+        response = await http_client.post(url, data=data)
+        if response.status_code != 200 and "message is not modified" not in response.text:
+            logger.warning(f"Не удалось обновить статус для пользователя {job.user_id}: {response.text}")
+    except Exception as e:
+        logger.warning(f"Ошибка при обновлении статуса для пользователя {job.user_id}: {e}")
 
 # Функции для работы с видео
-def split_video(file_path, output_prefix):
-    """Разбивает видео на части, каждая не превышает 50 МБ."""
-    max_part_size = 50000000  # Чуть меньше 50 МБ
-    total_size = os.path.getsize(file_path)
-    try:
-        with open(os.devnull, 'w') as devnull:
-            duration = float(subprocess.check_output([
-                'ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of',
-                'default=noprint_wrappers=1:nokey=1', file_path
-            ]).decode().strip())
-
-            approx_part_time = duration * max_part_size / total_size
-            part_time = max(10, int(approx_part_time))
-
-            subprocess.run([
-                'ffmpeg', '-i', file_path, '-c', 'copy', '-map', '0', '-segment_time',
-                str(part_time), '-f', 'segment', '-reset_timestamps', '1',
-                f"{output_prefix}_part_%03d.mp4"
-            ], stdout=devnull, stderr=devnull)
-        logger.info(f"Видео {file_path} успешно разбито на части.")
+async def run_process(args, on_line=None):
+    """Запускает процесс и возвращает код завершения и вывод; при отмене задания процесс завершается."""
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        if on_line is None:
+            # Вывод целиком (например, JSON от yt-dlp -J - одна строка в сотни КБ, больше лимита строки StreamReader)
+            stdout, _ = await process.communicate()
+            return process.returncode, stdout.decode(errors="replace")
+        output = []
+        async for line in process.stdout:
+            output.append(line)
+            await on_line(line.decode(errors="replace"))
+        return await process.wait(), b"".join(output).decode(errors="replace")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+async def segment_video(input_path, workspace, split_args, stdin=None):
+    """Нарезает видео ffmpeg и отдает готовые части по мере нарезки, не дожидаясь конца."""
+    started = time.perf_counter()
+    segment_list = os.path.join(workspace, "parts.csv")
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-i', input_path, '-c', 'copy', '-map', '0', *split_args,
+        '-f', 'segment', '-reset_timestamps', '1',
+        '-segment_list', segment_list, '-segment_list_type', 'csv',
+        os.path.join(workspace, "part_%03d.mp4"),
+        stdin=stdin, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    # ffmpeg дописывает строку в список частей, когда часть закрыта
+    offset = 0
+    buffer = ""
+    try:
+        while True:
+            finished = process.returncode is not None
+            if os.path.exists(segment_list):
+                with open(segment_list) as f:
+                    f.seek(offset)
+                    data = f.read()
+                    offset = f.tell()
+                lines = (buffer + data).split("\n")
+                buffer = lines.pop()
+                for line in lines:
+                    if line:
+                        yield os.path.join(workspace, line.split(",", 1)[0])
+            if finished:
+                break
+            try:
+                await asyncio.wait_for(process.wait(), SEGMENT_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg завершился с кодом {process.returncode}")
+        split_seconds.observe(time.perf_counter() - started)
+        logger.info(f"Видео {input_path} успешно разбито на части.")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+async def read_keyframes(file_path):
+    """Ключевые кадры видео (время, смещение в байтах от начала данных) и общий размер данных."""
+    _, output = await run_process([
+        'ffprobe', '-v', 'error', '-show_entries',
+        'stream=index,codec_type:packet=stream_index,pts_time,dts_time,size,flags',
+        '-of', 'compact', file_path
+    ])
+    streams = {}
+    packets = []
+    for line in output.splitlines():
+        section, _, fields = line.partition("|")
+        values = dict(field.split("=", 1) for field in fields.split("|") if "=" in field)
+        if section == "stream":
+            streams[values["index"]] = values.get("codec_type")
+        elif section == "packet":
+            packets.append(values)
+
+    # Резать можно только на ключевых кадрах видео; если видео нет - на любом пакете
+    video_streams = {index for index, codec_type in streams.items() if codec_type == "video"}
+    keyframes = []
+    offset = 0
+    for packet in packets:
+        if video_streams:
+            is_cut_point = packet.get("stream_index") in video_streams and "K" in packet.get("flags", "")
+        else:
+            is_cut_point = True
+        if is_cut_point:
+            time_value = packet.get("pts_time", "N/A")
+            if time_value == "N/A":
+                time_value = packet.get("dts_time", "N/A")
+            if time_value != "N/A":
+                keyframes.append((float(time_value), offset))
+        offset += int(packet.get("size", 0)) + PACKET_OVERHEAD
+    return keyframes, offset
+
+def plan_cuts(keyframes, total_size, limit):
+    """Времена разрезов: каждая часть как можно больше, но не больше limit, частей как можно меньше."""
+    cuts = []
+    start = 0
+    last = None  # Последний ключевой кадр, до которого текущая часть еще помещается
+    for time_value, offset in keyframes + [(None, total_size)]:
+        if offset - start > limit and last is not None:
+            cuts.append(last[0])
+            start = last[1]
+            last = None
+        if offset - start > limit:
+            # Между соседними ключевыми кадрами больше limit: меньше эту часть не сделать
+            logger.warning(f"Часть видео до {time_value or 'конца'} с. больше допустимого размера.")
+            if time_value is not None:
+                cuts.append(time_value)
+                start = offset
+        if time_value is not None and offset > start:
+            last = (time_value, offset)
+    return cuts
+
+async def split_video(file_path, workspace, limit=MAX_FILE_SIZE):
+    """Разбивает скачанное видео на части не больше limit по ключевым кадрам."""
+    try:
+        keyframes, total_size = await read_keyframes(file_path)
+    except (ValueError, KeyError) as e:
+        logger.warning(f"Не удалось прочитать ключевые кадры {file_path}, разбиваем по битрейту: {e}")
+        keyframes = []
+    if keyframes:
+        cuts = plan_cuts(keyframes, total_size, limit - PART_HEADROOM)
+        if not cuts:
+            yield file_path  # Разрезать негде
+            return
+        # Сегментатор режет на первом ключевом кадре не раньше заданного времени,
+        # небольшой сдвиг назад защищает от округления времени в выводе ffprobe
+        split_args = ['-segment_times', ",".join(f"{max(0, cut - 0.001):.6f}" for cut in cuts)]
+        logger.info(f"Видео {file_path}: запланировано частей - {len(cuts) + 1}.")
+    else:
+        _, output = await run_process([
+            'ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of',
+            'default=noprint_wrappers=1:nokey=1', file_path
+        ])
+        duration = float(output.strip())
+        part_size = limit * MAX_PART_SIZE / MAX_FILE_SIZE  # Тот же запас на неравномерный битрейт, что и для 50 МБ
+        part_time = max(10, int(duration * part_size / os.path.getsize(file_path)))
+        split_args = ['-segment_time', str(part_time)]
+    async for part in segment_video(file_path, workspace, split_args):
+        yield part
+
+async def probe_stream(url):
+    """Длительность и размер видео в формате PIPE_FORMAT или None, если они неизвестны."""
+    _, output = await run_process([
+        'yt-dlp', '-f', PIPE_FORMAT, '--simulate', '--print', '%(duration)s %(filesize,filesize_approx)s', url
+    ])
+    try:
+        duration, size = output.split()
+        return float(duration), int(float(size))
+    except ValueError:
+        return None
+
+async def download_segments(url, workspace, part_time, on_progress=None):
+    """Скачивает видео через канал прямо в ffmpeg и отдает части по мере нарезки."""
+    read_fd, write_fd = os.pipe()
+    try:
+        downloader = await asyncio.create_subprocess_exec(
+            'yt-dlp', '-f', PIPE_FORMAT, '-o', '-', '--newline', url,
+            stdout=write_fd, stderr=asyncio.subprocess.PIPE,
+        )
+    except OSError:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+
+    # При выводе в stdout yt-dlp пишет прогресс в stderr
+    async def watch_progress():
+        started = time.perf_counter()
+        async for line in downloader.stderr:
+            match = DOWNLOAD_PROGRESS_REGEX.search(line.decode(errors="replace"))
+            if match and on_progress is not None:
+                await on_progress(float(match.group(1)))
+        download_seconds.observe(time.perf_counter() - started)
+
+    progress_task = asyncio.create_task(watch_progress())
+    try:
+        parts = segment_video('pipe:0', workspace, ['-segment_time', str(part_time)], stdin=read_fd)
+        async with contextlib.aclosing(parts):
+            async for part in parts:
+                yield part
+        await progress_task
+        if await downloader.wait() != 0:
+            raise RuntimeError(f"yt-dlp завершился с кодом {downloader.returncode}")
+    finally:
+        os.close(read_fd)
+        progress_task.cancel()
+        if downloader.returncode is None:
+            downloader.kill()
+            await downloader.wait()
+
+@metrics.timed(video_info_seconds)
+async def get_video_info(url):
+    """Длительность и форматы видео из yt-dlp -J (без скачивания) с кэшем по ID видео; None при ошибке."""
+    try:
+        return await _get_video_info(url)
     except Exception as e:
-        logger.exception(f"Ошибка при разбиении видео {file_path}: {e}")
+        logger.warning(f"Не удалось получить сведения о форматах {url}: {e}")
+        return None
+
+async def _get_video_info(url):
+    video = video_id(url)
+    cached = video_info_cache.get(video)
+    if cached is not None and time.time() - cached[0] <= VIDEO_INFO_TTL:
+        video_info_lookups.inc(result="hit")
+        video_info_cache.move_to_end(video)
+        return cached[1]
+    video_info_lookups.inc(result="miss")
+    returncode, output = await run_process(['yt-dlp', '-J', '--no-warnings', url])
+    if returncode != 0:
+        logger.warning(f"Не удалось получить сведения о форматах {url}: yt-dlp завершился с кодом {returncode}")
+        return None
+    try:
+        raw = json.loads(output)
+    except ValueError as e:
+        logger.warning(f"Не удалось разобрать сведения о форматах {url}: {e}")
+        return None
+    # Храним только то, что нужно для подбора формата: полный ответ занимает мегабайты
+    fields = ("format_id", "ext", "height", "vcodec", "acodec", "tbr", "abr", "filesize", "filesize_approx")
+    info = {
+        "duration": raw.get("duration"),
+        "formats": [{field: fmt.get(field) for field in fields} for fmt in raw.get("formats") or []],
+    }
+    video_info_cache[video] = (time.time(), info)
+    while len(video_info_cache) > VIDEO_INFO_CACHE_SIZE:
+        video_info_cache.popitem(last=False)
+    return info
+
+def format_size(fmt, duration):
+    """Размер формата в байтах: из метаданных или по битрейту; None, если неизвестен."""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if not size and fmt.get("tbr") and duration:
+        size = fmt["tbr"] * 1000 / 8 * duration
+    return size
 
+def has_codec(codec):
+    return codec not in (None, "none")
 
-def download_video(url, output_file):
+def plan_format(info, limit):
+    """Лучший формат, который целиком укладывается в limit: (селектор yt-dlp, оценочный размер) или None.
+
+    Если ни один формат не ниже MIN_FIT_HEIGHT не укладывается, выбирается лучший - его придется разбивать.
+    """
+    duration = info.get("duration")
+    formats = info["formats"]
+    audio = [
+        fmt for fmt in formats
+        if has_codec(fmt.get("acodec")) and not has_codec(fmt.get("vcodec")) and format_size(fmt, duration)
+    ]
+    # m4a склеивается с видео в mp4 без перекодирования
+    best_audio = max(audio, key=lambda fmt: (fmt.get("ext") == "m4a", fmt.get("abr") or fmt.get("tbr") or 0), default=None)
+
+    candidates = []  # (высота, битрейт, селектор, размер)
+    for fmt in formats:
+        height = fmt.get("height") or 0
+        size = format_size(fmt, duration)
+        if not has_codec(fmt.get("vcodec")) or height > MAX_HEIGHT or not size:
+            continue
+        if has_codec(fmt.get("acodec")):
+            candidates.append((height, fmt.get("tbr") or 0, fmt["format_id"], size))
+        elif best_audio is not None:
+            selector = f"{fmt['format_id']}+{best_audio['format_id']}"
+            candidates.append((height, fmt.get("tbr") or 0, selector, size + format_size(best_audio, duration)))
+    if not candidates:
+        return None
+    candidates.sort(key=lambda candidate: (candidate[0], candidate[1]), reverse=True)
+    for height, _, selector, size in candidates:
+        if height >= MIN_FIT_HEIGHT and size <= limit * FORMAT_SIZE_MARGIN:
+            return selector, size
+    _, _, selector, size = candidates[0]
+    return selector, size
+
+@metrics.timed(download_seconds)
+async def download_video(url, output_file, on_progress=None, video_format=VIDEO_FORMAT):
     """Скачивает видео с YouTube с помощью yt-dlp."""
+    async def on_line(line):
+        match = DOWNLOAD_PROGRESS_REGEX.search(line)
+        if match and on_progress is not None:
+            await on_progress(float(match.group(1)))
+
     try:
-        with open(os.devnull, 'w') as devnull:
-            subprocess.run(
-                ['yt-dlp', '-f', 'bv*[height<=720]+ba/best', '--merge-output-format', 'mp4', '-o', output_file, '--force-overwrites', url],
-                stdout=devnull, stderr=devnull, check=True
-            )
-        logger.info(f"Видео по URL {url} успешно загружено в файл {output_file}.")
-        return os.path.exists(output_file)
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Ошибка при скачивании видео {url}: {e}")
+        returncode, _ = await run_process(
+            ['yt-dlp', '-f', video_format, '--merge-output-format', 'mp4', '-o', output_file,
+             '--force-overwrites', '--newline', url],
+            on_line=on_line,
+        )
+    except OSError as e:
+        logger.error(f"Ошибка при запуске yt-dlp для {url}: {e}")
         return False
+    if returncode != 0:
+        logger.error(f"Ошибка при скачивании видео {url}: yt-dlp завершился с кодом {returncode}")
+        return False
+    if not os.path.exists(output_file):
+        return False
+    download_bytes_total.inc(os.path.getsize(output_file))
+    logger.info(f"Видео по URL {url} успешно загружено в файл {output_file}.")
+    return True
 
-def process_video(url, user_id):
+async def process_video(job):
     """Скачивает и отправляет видео, разбивая на части при необходимости."""
-    output_file = "video.mp4"
+    videos_in_progress.inc()
+    try:
+        await _process_video(job)
+    finally:
+        videos_in_progress.dec()
+
+def use_pipe():
+    """Скачивать ли через канал в ffmpeg: со своим сервером Bot API разбиение обычно не нужно."""
+    return PIPE_DOWNLOAD and not local_api
+
+async def send_cached_video(job, file_ids):
+    """Отправляет видео из кэша и возвращает file_id отправленных частей: если file_id одной из частей
+    больше не действует, отправка останавливается на ней, чтобы после скачивания продолжить с этой части."""
+    sent = []
+    for number, file_id in enumerate(file_ids, 1):
+        caption = job.url if len(file_ids) == 1 else f"{job.url} (часть {number})"
+        if not await send_video_by_id(file_id, job.user_id, caption):
+            break
+        sent.append(file_id)
+    return sent
+
+async def _process_video(job):
+    url, user_id = job.url, job.user_id
+    video = video_id(url)
+    workspace = tempfile.mkdtemp(prefix=f"yt-{job.id}-", dir=WORK_DIR)
+    output_file = os.path.join(workspace, "video.mp4")
     logger.info(f"Пользователь {user_id} запросил загрузку видео: {url}")
 
-    if not download_video(url, output_file):
-        logger.error(f"Не удалось загрузить видео: {url}")
-        last_message_time.pop(user_id, None)  # Сброс таймера
-        send_message(user_id, "Видео недоступно или не может быть загружено.")
-        return
+    download_note = ""  # Дополнение к сообщению о ходе скачивания
+
+    async def on_progress(percent):
+        await update_status(job, f"Скачивание: {percent:.0f}%{download_note}")
 
     try:
-        if os.path.getsize(output_file) <= MAX_FILE_SIZE:
-            send_video(output_file, user_id, caption=url)
+        # Кэш проверяется до обращений к YouTube: ключ - ID видео и способ отправки
+        key = cache_key(video, delivery_mode())
+        delivered = []  # file_id частей, уже отправленных из кэша
+        cached = video_cache.get(key)
+        if cached:
+            delivered = await send_cached_video(job, cached["file_ids"])
+            if len(delivered) == len(cached["file_ids"]):
+                logger.info(f"Видео {url} отправлено пользователю {user_id} из кэша.")
+                videos_total.inc(result="cached")
+                await update_status(job, "Готово.", force=True)
+                return
+            video_cache.discard(key)
+
+        # Если часть видео уже отправлена из кэша, остальные части нарезаются из того же формата
+        resume_format = cached.get("format") if delivered else None
+        stream = await probe_stream(url) if use_pipe() and resume_format in (None, PIPE_FORMAT) else None
+        if stream is not None:
+            video_format = PIPE_FORMAT
+        elif resume_format not in (None, PIPE_FORMAT):
+            video_format = resume_format
         else:
-            logger.info(f"Видео {output_file} превышает 50 МБ. Разбиваем на части...")
-            split_video(output_file, "video_part")
-            for part in sorted(os.listdir('.')):
-                if part.startswith("video_part") and part.endswith(".mp4"):
-                    send_video(part, user_id, caption=f"{url} (часть {part})")
+            # Подбираем формат заранее: часто видео пониже качеством помещается в один файл
+            info = await get_video_info(url)
+            plan = plan_format(info, max_upload_size) if info else None
+            video_format = VIDEO_FORMAT
+            if plan is not None:
+                video_format, estimated_size = plan
+                parts_planned = math.ceil(estimated_size / max_upload_size)
+                logger.info(f"Для {url} выбран формат {video_format}: около {estimated_size / 1e6:.0f} МБ, частей - {parts_planned}.")
+                if parts_planned > 1:
+                    download_note = f" (видео большое, будет частей: около {parts_planned})"
+
+        await update_status(job, "Скачивание...", force=True)
+        sent = []  # file_id отправленных частей
+        parts = None
+        if stream is not None:
+            duration, size = stream
+            part_time = max(10, int(duration * MAX_PART_SIZE / max(size, 1)))
+            parts = download_segments(url, workspace, part_time, on_progress)
+        else:
+            if not await download_video(url, output_file, on_progress, video_format):
+                logger.error(f"Не удалось загрузить видео: {url}")
+                videos_total.inc(result="failed")
+                last_message_time.pop(user_id, None)  # Сброс таймера
+                await update_status(job, "Видео недоступно или не может быть загружено.", force=True)
+                return
+
+            size = os.path.getsize(output_file)
+            file_id = None
+            if size <= max_upload_size:
+                await update_status(job, "Отправка...", force=True)
+                file_id = await send_video(output_file, user_id, caption=url)
+            if file_id is not None or size <= MAX_FILE_SIZE:
+                sent.append(file_id)
+            else:
+                # Файл больше лимита или свой сервер Bot API его не принял: разбиваем на части
+                if size <= max_upload_size:
+                    logger.warning(f"Сервер Bot API не принял видео {output_file} ({size / 1e6:.0f} МБ). Разбиваем на части...")
+                else:
+                    logger.info(f"Видео {output_file} больше {max_upload_size / 1e6:.0f} МБ. Разбиваем на части...")
+                await update_status(job, "Разбиение на части...", force=True)
+                # Больше лимита своего сервера - части под этот лимит; сервер не принял файл - части по 50 МБ
+                parts = split_video(output_file, workspace, max_upload_size if size > max_upload_size else MAX_FILE_SIZE)
+
+        if parts is not None:
+            # Каждая часть отправляется, как только ffmpeg ее закрыл, пока следующие еще нарезаются
+            async with contextlib.aclosing(parts):
+                async for part in parts:
+                    number = len(sent) + 1
+                    if number <= len(delivered):
+                        # Часть уже отправлена из кэша, пока не встретился устаревший file_id
+                        sent.append(delivered[number - 1])
+                    else:
+                        await update_status(job, f"Отправка части {number}...", force=True)
+                        sent.append(await send_video(part, user_id, caption=f"{url} (часть {number})"))
                     os.remove(part)
-        os.remove(output_file)
+        if not sent or not all(sent):
+            logger.error(f"Видео {url} не отправлено пользователю {user_id} полностью: частей {len(sent)}, не отправлено {sent.count(None)}.")
+            videos_total.inc(result="failed")
+            last_message_time.pop(user_id, None)  # Сброс таймера
+            await update_status(job, "Не удалось отправить видео.", force=True)
+            return
+        video_cache.put(key, sent, video_format)
+        videos_total.inc(result="ok")
+        await update_status(job, "Готово.", force=True)
+    except asyncio.CancelledError:
+        videos_total.inc(result="cancelled")
+        last_message_time.pop(user_id, None)  # Сброс таймера
+        await update_status(job, "Обработка отменена.", force=True)
+        raise
     except Exception as e:
         logger.exception(f"Ошибка при обработке видео {url}: {e}")
+        videos_total.inc(result="failed")
         last_message_time.pop(user_id, None)  # Сброс таймера
-        send_message(user_id, "Произошла ошибка при обработке видео.")
+        await update_status(job, "Произошла ошибка при обработке видео.", force=True)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+async def wait_in_flight(job, in_flight):
+    """Ждет, пока то же видео обработается по другому запросу, и возвращает видео в очередь:
+    ожидание не занимает обработчик, а после него видео обычно отправляется из кэша."""
+    try:
+        await update_status(job, "Это видео уже обрабатывается, подожди...", force=True)
+        await in_flight.wait()
+    except asyncio.CancelledError:
+        job_queue.finish(job)
+        raise
+    job_queue.running.discard(job)
+    job.task = None
+    await job_queue.put(job)
+
+# Обработчик очереди: берет видео по очереди и обрабатывает каждое в отдельной задаче,
+# чтобы команда /cancel могла прервать обработку, не останавливая сам обработчик
+async def video_worker():
+    while True:
+        job = await job_queue.get()
+        queue_wait_seconds.observe(time.monotonic() - job.created)
+        video = video_id(job.url)
+        if video in videos_in_flight:
+            # То же видео уже обрабатывается: ждем его в отдельной задаче, обработчик берет следующее
+            job.task = asyncio.create_task(wait_in_flight(job, videos_in_flight[video]))
+            continue
+        in_flight = videos_in_flight[video] = asyncio.Event()
+        job.task = asyncio.create_task(process_video(job))
+        try:
+            await asyncio.wait({job.task})
+        except asyncio.CancelledError:
+            job.task.cancel()
+            raise
+        finally:
+            del videos_in_flight[video]
+            in_flight.set()
+            job_queue.finish(job)
+
+def detect_bot_api():
+    """Проверяет свой сервер Bot API; если он отвечает, видео до 2 ГБ отправляются через него без разбиения."""
+    global TELEGRAM_API_URL, local_api, max_upload_size
+    if not LOCAL_BOT_API_URL:
+        return False
+    try:
+        response = httpx.get(f"{LOCAL_BOT_API_URL}/bot{TOKEN}/getMe", timeout=10)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.warning(f"Свой сервер Bot API {LOCAL_BOT_API_URL} недоступен, видео больше 50 МБ будут разбиваться: {e}")
+        return False
+    TELEGRAM_API_URL = LOCAL_BOT_API_URL
+    local_api = True
+    max_upload_size = LOCAL_MAX_FILE_SIZE
+    logger.info(f"Используется свой сервер Bot API {LOCAL_BOT_API_URL}, лимит файла {LOCAL_MAX_FILE_SIZE} байт.")
+    return True
+
+async def start_workers(application=None):
+    """Создает очередь видео и запускает обработчики."""
+    global job_queue, workers, http_client, video_cache
+    http_client = httpx.AsyncClient(timeout=UPLOAD_TIMEOUT)
+    video_cache = VideoCache(VIDEO_CACHE_FILE, VIDEO_CACHE_SIZE, VIDEO_CACHE_TTL)
+    video_cache.load()
+    job_queue = JobQueue()
+    workers = [asyncio.create_task(video_worker()) for _ in range(VIDEO_WORKERS)]
+    logger.info(f"Запущено обработчиков видео: {VIDEO_WORKERS}")
+
+async def stop_workers(application=None):
+    """Останавливает обработчики очереди."""
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await http_client.aclose()
 
 # Команды бота
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -121,15 +850,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Пользователь {user_id} вызвал команду /start.")
     await update.message.reply_text("Привет! Пришли мне URL видео на YouTube, и я обработаю его.")
 
-def send_message(user_id, text):
-    url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
-    try:
-        response = requests.post(url, data={'chat_id': user_id, 'text': text})
-        if response.status_code != 200:
-            logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {response.text}")
-    except Exception as e:
-        logger.exception(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
-
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     user_message = update.message.text.strip()
@@ -151,8 +871,29 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     last_message_time[user_id] = current_time
-    await update.message.reply_text("Видео обрабатывается, подожди...")
-    process_video(user_message, user_id)
+    job = VideoJob(user_message, user_id)
+    status = await update.message.reply_text("Видео обрабатывается, подожди...")
+    job.status_message_id = status.message_id
+    position = await job_queue.put(job)
+    if position is not None and position > job_queue.idle:
+        await update_status(job, f"Видео в очереди, позиция: {position}. Отменить - /cancel", force=True)
+
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    cancelled = job_queue.cancel(user_id)
+    if cancelled:
+        last_message_time.pop(user_id, None)  # Сброс таймера
+        logger.info(f"Пользователь {user_id} отменил видео: {cancelled}")
+        await update.message.reply_text(f"Отменено видео: {cancelled}.")
+    else:
+        await update.message.reply_text("Нет видео в очереди или в обработке.")
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    if str(user_id) not in admin_ids:
+        await update.message.reply_text("Команда доступна только администраторам.")
+        return
+    await update.message.reply_text(metrics.summary())
 
 # Загрузка разрешённых ID
 def load_allowed_ids():
@@ -164,11 +905,29 @@ def load_allowed_ids():
     except FileNotFoundError:
         logger.error("Файл ids.txt не найден.")
 
+# Загрузка ID администраторов
+def load_admin_ids():
+    global admin_ids
+    try:
+        with open("admins.txt", "r") as f:
+            admin_ids = [line.strip() for line in f]
+        logger.info("Файл admins.txt успешно загружен.")
+    except FileNotFoundError:
+        logger.error("Файл admins.txt не найден.")
+
 # Главная функция
 def main():
     load_allowed_ids()
-    app = ApplicationBuilder().token(TOKEN).build()
+    load_admin_ids()
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    builder = ApplicationBuilder().token(TOKEN).post_init(start_workers).post_shutdown(stop_workers)
+    if detect_bot_api():
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot").local_mode(True)
+    app = builder.build()
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("cancel", cancel))
+    app.add_handler(CommandHandler("stats", stats))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     logger.info("Бот запущен. Нажми Ctrl+C для остановки.")